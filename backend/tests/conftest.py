@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app imports its modules as `utils.*`, relative to backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# utils.core creates its Gemini client at import; tests replace it before any call
+os.environ.setdefault("GEMINI_API_KEY", "test")
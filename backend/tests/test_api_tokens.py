@@ -0,0 +1,71 @@
+from utils import api_tokens
+from utils.api_tokens import RevocationList, issue_token, decode_token
+import mongomock
+import pytest
+import time
+
+@pytest.fixture(autouse=True)
+def signing_keys(monkeypatch):
+    monkeypatch.setattr(api_tokens, "SIGNING_KEYS", {"new": b"new secret", "old": b"old secret"})
+    monkeypatch.setattr(api_tokens, "SIGNING_KEY_ID", "new")
+
+def _claims(token):
+    return decode_token(token)
+
+def test_issued_token_verifies():
+    claims = _claims(issue_token("u1", "alice", "alice@example.com"))
+    assert (claims["uid"], claims["sub"], claims["email"]) == ("u1", "alice", "alice@example.com")
+
+def test_token_signed_with_a_rotated_out_key_still_verifies(monkeypatch):
+    monkeypatch.setattr(api_tokens, "SIGNING_KEY_ID", "old")
+    token = issue_token("u1", "alice", "alice@example.com")
+    monkeypatch.setattr(api_tokens, "SIGNING_KEY_ID", "new")
+    assert _claims(token)["uid"] == "u1"
+
+def test_expired_token_is_rejected():
+    assert _claims(issue_token("u1", "alice", "alice@example.com", ttl=-1)) is None
+
+def test_tampered_token_is_rejected():
+    prefix, kid, payload, signature = issue_token("u1", "alice", "alice@example.com").split(".")
+    forged = api_tokens._b64encode(b'{"uid":"victim","sub":"victim","email":"v@example.com","jti":"x","iat":0,"exp":9999999999}')
+    assert _claims(f"{prefix}.{kid}.{forged}.{signature}") is None
+    assert _claims(f"{prefix}.{kid}.{payload}.{signature[:-2]}AA") is None
+    assert _claims("v1.new.not-base64!.sig") is None
+
+def test_unknown_key_id_is_rejected(monkeypatch):
+    token = issue_token("u1", "alice", "alice@example.com")
+    monkeypatch.setattr(api_tokens, "SIGNING_KEYS", {"other": b"new secret"})
+    assert _claims(token) is None
+
+def test_signed_mode_requires_a_key(monkeypatch):
+    monkeypatch.setattr(api_tokens, "API_KEY_MODE", "signed")
+    monkeypatch.delenv("API_TOKEN_KEYS", raising=False)
+    monkeypatch.delenv("API_KEY_SECRET", raising=False)
+    with pytest.raises(RuntimeError):
+        api_tokens._signing_keys()
+    monkeypatch.setenv("API_TOKEN_KEYS", "kid1:")
+    with pytest.raises(RuntimeError):
+        api_tokens._signing_keys()
+    monkeypatch.setenv("API_KEY_SECRET", "s3cret")
+    assert api_tokens._signing_keys() == {"default": b"s3cret"}
+
+def test_revocations_sync_between_processes():
+    collection = mongomock.MongoClient().db.revoked_tokens
+    here, there = RevocationList(collection), RevocationList(collection)
+    claims = _claims(issue_token("u1", "alice", "alice@example.com"))
+    other = _claims(issue_token("u2", "bob", "bob@example.com"))
+
+    time.sleep(0.01)
+    here.revoke_user("u1")
+    assert here.is_revoked(claims)
+    assert not there.is_revoked(claims)
+    there.sync()
+    assert there.is_revoked(claims)
+    assert not there.is_revoked(other)
+
+    # Tokens issued after the revocation are fine; single tokens can be revoked by jti
+    assert not there.is_revoked(_claims(issue_token("u1", "alice", "alice@example.com")))
+    collection.insert_one({"jti": other["jti"], "expires_at": api_tokens.datetime.now(api_tokens.timezone.utc) + api_tokens.timedelta(hours=1)})
+    there.sync()
+    assert there.is_revoked(other)
+    assert there.stats()["revoked_tokens"] == 1
@@ -0,0 +1,38 @@
+from utils.artifacts import ArtifactStore, DiskBackend, MemoryBackend
+import os
+import time
+
+def test_memory_artifact_is_dropped_on_last_release():
+    store = ArtifactStore(MemoryBackend(), ttl=60)
+    artifact_id = store.put(b"wav")
+    store.acquire(artifact_id)
+    store.acquire(artifact_id)
+    store.release(artifact_id)
+    assert store.read(artifact_id) == b"wav"
+    store.release(artifact_id)
+    assert store.stats()["count"] == 0
+    assert store.stats()["deleted"] == 1
+
+def test_disk_artifact_waits_for_expiry(tmp_path):
+    store = ArtifactStore(DiskBackend(str(tmp_path)), ttl=0)
+    artifact_id = store.put(b"wav")
+    store.acquire(artifact_id)
+    assert store.sweep() == 0
+    store.release(artifact_id)
+    assert os.path.exists(store.path(artifact_id))
+    assert store.sweep() == 1
+    assert not os.path.exists(store.path(artifact_id))
+
+def test_startup_keeps_fresh_files_of_other_workers(tmp_path):
+    sibling = ArtifactStore(DiskBackend(str(tmp_path)), ttl=60)
+    live = sibling.put(b"live")
+    (tmp_path / "inflight.wav.tmp").write_bytes(b"partial")
+    stale = tmp_path / "crashed.wav"
+    stale.write_bytes(b"old")
+    an_hour_ago = time.time() - 3600
+    os.utime(stale, (an_hour_ago, an_hour_ago))
+
+    store = ArtifactStore(DiskBackend(str(tmp_path)), ttl=60)
+    store.start_janitor(interval=3600)
+    store.stop_janitor()
+    assert sorted(os.listdir(tmp_path)) == sorted([f"{live}.wav", "inflight.wav.tmp"])
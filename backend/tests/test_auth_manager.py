@@ -0,0 +1,64 @@
+from utils import auth_manager
+from utils.auth_manager import UserManager, AsyncUserManager
+import asyncio
+import hashlib
+import pytest
+
+@pytest.fixture
+def manager(monkeypatch):
+    # A fresh singleton on the in-process mongomock backend
+    monkeypatch.setattr(auth_manager, "db_backend", "memory")
+    monkeypatch.setattr(UserManager, "_instance", None)
+    manager = UserManager()
+    yield manager
+    manager.close_connection()
+
+def test_ensure_indexes(manager):
+    manager.ensure_indexes()
+    indexes = manager.collection.index_information()
+    assert indexes["username_1"]["unique"]
+    assert indexes["email_1"]["unique"]
+    assert "api_key_1" in indexes
+    assert manager.revocations.collection.index_information()["expires_at_1"]["expireAfterSeconds"] == 0
+    assert manager.collection.name == "users"
+
+def test_api_key_cache_counts_each_lookup_once(manager):
+    api_key = manager.add_user("alice", "alice@example.com", "correct horse")["api_key"]
+
+    assert manager.check_api_key(api_key)["username"] == "alice"
+    assert manager.check_api_key(api_key)["username"] == "alice"
+    stats = manager.api_key_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+    # Unknown keys are cached too, and the async path does a single cache lookup per call
+    async_manager = AsyncUserManager(manager)
+    assert not asyncio.run(async_manager.check_api_key("not-a-key"))["success"]
+    assert not asyncio.run(async_manager.check_api_key("not-a-key"))["success"]
+    stats = manager.api_key_cache_stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+
+def test_invalidated_key_is_looked_up_again(manager):
+    api_key = manager.add_user("bob", "bob@example.com", "correct horse")["api_key"]
+    manager.check_api_key(api_key)
+    manager.invalidate_api_key(api_key)
+    manager.collection.delete_one({"username": "bob"})
+    assert not manager.check_api_key(api_key)["success"]
+
+def test_login_upgrades_a_legacy_hash(manager):
+    manager.collection.insert_one({"username": "carol", "email": "carol@example.com", "api_key": "k",
+                                   "password_hash": hashlib.sha256(b"correct horse").hexdigest()})
+    assert manager.authenticate_user("carol", "correct horse")["success"]
+    stored = manager.collection.find_one({"username": "carol"})["password_hash"]
+    assert stored.startswith("$scrypt$")
+    assert manager.authenticate_user("carol", "correct horse")["success"]
+    assert not manager.authenticate_user("carol", "wrong horse")["success"]
+
+def test_unknown_user_still_runs_the_kdf(manager, monkeypatch):
+    checked = []
+    monkeypatch.setattr(auth_manager, "dummy_verify", checked.append)
+    assert manager.authenticate_user("nobody", "pw")["message"] == "User not found"
+    assert checked == ["pw"]
+
+def test_malformed_stored_hash_is_an_invalid_password(manager):
+    manager.collection.insert_one({"username": "dave", "email": "dave@example.com", "password_hash": "$scrypt$bad"})
+    assert manager.authenticate_user("dave", "pw") == {"success": False, "message": "Invalid password"}
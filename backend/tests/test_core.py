@@ -0,0 +1,56 @@
+from utils import core
+import asyncio
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+class _FailingModels:
+    # Sends part of an answer, then the connection drops
+    async def generate_content_stream(self, **kwargs):
+        async def chunks():
+            yield _Chunk("There is a mug. ")
+            raise ValueError("stream broken")
+        return chunks()
+
+class _FailingClient:
+    class aio:
+        models = _FailingModels()
+
+async def _collect(iterable):
+    return [item async for item in iterable]
+
+def test_stream_failure_after_partial_text_is_not_a_complete_answer(monkeypatch):
+    monkeypatch.setattr(core, "g_client", _FailingClient())
+    parts = asyncio.run(_collect(core.generate_request_stream(core.frames_request([(b"image", "image/jpeg")], "what is this?"))))
+    assert parts == ["There is a mug. ", core.ERROR_MESSAGE]
+    assert not core.is_complete_answer(parts)
+
+def test_answers_are_told_from_fallbacks_by_type():
+    assert core.is_complete_answer(["There is a mug. ", "It is red."])
+    assert not core.is_complete_answer([])
+    assert not core.is_error_answer(str(core.ERROR_MESSAGE))
+    assert core.is_error_answer(core.EMPTY_ANSWER_MESSAGE)
+
+def _frame(bits):
+    return (b"", "jpeg", bits)
+
+def test_distinct_frames_drops_repeats_up_to_the_threshold(monkeypatch):
+    monkeypatch.setattr(core, "BURST_DUPLICATE_DISTANCE", 6)
+    six, seven = 0b111111, 0b1111111
+    frames = [_frame(0), _frame(six), _frame(seven), _frame(seven | 1 << 20)]
+    # Six bits from the first frame is a repeat, seven is new; each frame is compared with the last one kept
+    assert core.distinct_frames(frames) == [frames[0], frames[2]]
+
+def test_distinct_frames_keeps_a_changing_scene(monkeypatch):
+    monkeypatch.setattr(core, "BURST_DUPLICATE_DISTANCE", 6)
+    frames = [_frame(0), _frame(2 ** 64 - 1), _frame(0)]
+    assert core.distinct_frames(frames) == frames
+    assert core.distinct_frames([]) == []
+
+def test_burst_request_puts_frames_after_the_instruction():
+    images = [(b"one", "image/jpeg"), (b"two", "image/jpeg")]
+    contents = core.frames_request(images, "what changed?")["contents"]
+    assert contents[:2] == [core.BURST_INSTRUCTION, "what changed?"]
+    assert [part.inline_data.data for part in contents[2:]] == [b"one", b"two"]
+    assert core.frames_request(images[:1], "what is this?")["contents"][0] == "what is this?"
@@ -0,0 +1,30 @@
+from google.genai import errors
+from utils import gemini_client
+import asyncio
+
+class _Models:
+    # The retired model answers 404, the fallback answers
+    def __init__(self):
+        self.calls = []
+
+    async def generate_content(self, model, **kwargs):
+        self.calls.append(model)
+        if model == "retired":
+            raise errors.ClientError(404, {"error": {"code": 404, "message": "models/retired is not found", "status": "NOT_FOUND"}})
+        return f"answer from {model}"
+
+class _Client:
+    def __init__(self):
+        self.aio = type("aio", (), {"models": _Models()})()
+
+def test_missing_model_falls_through_to_the_next_model_without_retries():
+    client = _Client()
+    resilient = gemini_client.ResilientClient(lambda: client, ["retired", "fallback"])
+    assert asyncio.run(resilient.generate({"contents": "hi"})) == "answer from fallback"
+    assert client.aio.models.calls == ["retired", "fallback"]
+    assert resilient.stats()["retired"]["circuit"] == "closed"
+
+def test_bad_request_is_not_a_model_error():
+    bad_image = errors.ClientError(400, {"error": {"code": 400, "message": "Unable to process input image", "status": "INVALID_ARGUMENT"}})
+    assert not gemini_client.is_model_error(bad_image)
+    assert gemini_client.is_model_error(errors.ClientError(403, {"error": {"code": 403, "message": "denied"}}))
@@ -0,0 +1,28 @@
+from utils.lifecycle import ModelComponent, ModelUnavailableError
+import threading
+import pytest
+
+def test_callers_do_not_wait_for_a_background_load():
+    started, release = threading.Event(), threading.Event()
+
+    def load():
+        started.set()
+        release.wait(5)
+
+    component = ModelComponent("tts", load, [], enabled=True)
+    loader = threading.Thread(target=component.ensure_ready)
+    loader.start()
+    started.wait(5)
+    with pytest.raises(ModelUnavailableError) as error:
+        component.ensure_ready(wait=False)
+    assert error.value.state == "loading" and error.value.retry_after
+    release.set()
+    loader.join(5)
+    component.ensure_ready(wait=False)
+    assert component.state == "ready"
+
+def test_warm_ups_reenter_on_the_loading_thread():
+    calls = []
+    component = ModelComponent("stt", lambda: None, [lambda: component.ensure_ready(wait=False) or calls.append(1)], enabled=True)
+    component.ensure_ready()
+    assert calls == [1] and component.state == "ready"
@@ -0,0 +1,32 @@
+from utils import passwords
+from utils.passwords import hash_password, verify_password, needs_rehash, ScryptHasher
+import hashlib
+
+def test_hash_verifies_and_is_salted():
+    stored = hash_password("correct horse")
+    assert verify_password("correct horse", stored)
+    assert not verify_password("wrong horse", stored)
+    assert hash_password("correct horse") != stored
+    assert not needs_rehash(stored)
+
+def test_malformed_hash_fails_instead_of_raising():
+    for stored in ("$scrypt$bad", "$scrypt$n=x,r=8,p=1$salt$hash", "$scrypt$n=16384$c2FsdA$!!", "plain"):
+        assert not verify_password("pw", stored)
+
+def test_legacy_and_outdated_hashes_need_rehash(monkeypatch):
+    legacy = hashlib.sha256(b"pw").hexdigest()
+    assert verify_password("pw", legacy)
+    assert needs_rehash(legacy)
+
+    cheap = ScryptHasher(n=2 ** 10).hash("pw")
+    assert verify_password("pw", cheap)
+    assert needs_rehash(cheap)
+
+def test_dummy_verify_runs_the_kdf(monkeypatch):
+    calls = []
+    derive = ScryptHasher._derive
+    monkeypatch.setattr(ScryptHasher, "_derive", lambda self, *args, **kwargs: calls.append(1) or derive(self, *args, **kwargs))
+    passwords._dummy_hash()
+    calls.clear()
+    assert not passwords.dummy_verify("pw")
+    assert calls == [1]
@@ -0,0 +1,45 @@
+from utils.executor import BoundedExecutor
+from utils.pipeline import pipelined_tts, split_sentences, StageTimings
+import asyncio
+
+async def _chunks(pieces):
+    for piece in pieces:
+        yield piece
+
+async def _collect(iterable):
+    return [item async for item in iterable]
+
+def test_split_sentences_rejoins_pieces():
+    sentences = asyncio.run(_collect(split_sentences(_chunks(["Hello the", "re. A sec", "ond one! Last"]))))
+    assert sentences == ["Hello there.", "A second one!", "Last"]
+
+def test_first_sentence_is_synthesized_before_the_stream_ends():
+    executor = BoundedExecutor("test-tts", 1, 0)
+    timings = StageTimings()
+    first_audio = asyncio.Event()
+    finished = []
+
+    async def fake_llm():
+        # Holds back the rest of the answer until audio for the first sentence has come out
+        yield "There is a red mug. It is on the "
+        try:
+            await asyncio.wait_for(first_audio.wait(), 5)
+        finally:
+            finished.append(first_audio.is_set())
+        yield "desk."
+
+    async def run():
+        pcm = []
+        async for chunk in pipelined_tts(fake_llm(), executor, timings, synthesize=lambda text, voice, speed: text.encode()):
+            pcm.append(chunk)
+            first_audio.set()
+        return pcm
+
+    try:
+        pcm = asyncio.run(run())
+    finally:
+        executor.shutdown()
+    assert pcm == [b"There is a red mug.", b"It is on the desk."]
+    assert finished == [True]
+    assert timings.marks["first_audio"] < timings.marks["llm_done"]
+    assert executor.stats()["queued"] == 0
@@ -0,0 +1,40 @@
+from utils import rate_limit
+from utils.rate_limit import TokenBucketLimiter, RateLimitedError
+import pytest
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit.time, "monotonic", lambda: now[0])
+    return now
+
+def test_burst_then_limited_with_retry_after(clock):
+    limiter = TokenBucketLimiter("login", rate_per_minute=6, burst=2)
+    limiter.hit("alice")
+    limiter.hit("alice")
+    with pytest.raises(RateLimitedError) as error:
+        limiter.hit("alice")
+    assert error.value.retry_after == 10
+    # Other keys have their own bucket
+    limiter.hit("bob")
+    assert limiter.stats() == {"keys": 2, "allowed": 3, "limited": 1}
+
+def test_bucket_refills_over_time(clock):
+    limiter = TokenBucketLimiter("login", rate_per_minute=6, burst=1)
+    limiter.hit("alice")
+    clock[0] += 5
+    with pytest.raises(RateLimitedError) as error:
+        limiter.hit("alice")
+    assert error.value.retry_after == 5
+    clock[0] += 5
+    limiter.hit("alice")
+
+def test_least_recently_seen_keys_are_forgotten(clock):
+    limiter = TokenBucketLimiter("login", rate_per_minute=6, burst=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        limiter.hit(key)
+    assert limiter.stats()["keys"] == 2
+    # "a" fell out and starts over with a full bucket; "c" is still empty
+    limiter.hit("a")
+    with pytest.raises(RateLimitedError):
+        limiter.hit("c")
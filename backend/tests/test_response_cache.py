@@ -0,0 +1,63 @@
+from utils.response_cache import ResponseCache, DiskTier, dhash
+from PIL import Image
+import io
+import os
+import time
+
+def _jpeg(shift=0, quality=90, flip=False):
+    # A diagonal gradient; `shift` brightens it slightly, like a second frame from the same camera
+    img = Image.new("L", (128, 96))
+    img.putdata([min(255, x + y + shift) for y in range(96) for x in range(128)])
+    if flip:
+        img = img.transpose(Image.Transpose.FLIP_LEFT_RIGHT)
+    out = io.BytesIO()
+    img.convert("RGB").save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+def test_exact_hit_ignores_query_case_and_punctuation():
+    cache = ResponseCache(disk_dir=None)
+    cache.put(cache.key_for(_jpeg(), "What is this?", "m", "af"), "A gradient.", b"wav")
+    assert cache.get(cache.key_for(_jpeg(), "  what is   THIS ", "m", "af"))["text"] == "A gradient."
+    assert cache.get(cache.key_for(_jpeg(), "what is this", "m", "bf")) is None
+    assert cache.get(cache.key_for(_jpeg(), "what is this", "other", "af")) is None
+    assert (cache.stats()["memory_hits"], cache.stats()["misses"]) == (1, 2)
+
+def test_near_duplicate_frame_reuses_the_answer_for_the_same_question():
+    cache = ResponseCache(disk_dir=None, near_distance=6)
+    assert dhash(_jpeg()) != dhash(_jpeg(flip=True))
+    cache.put(cache.key_for(_jpeg(), "what is this", "m", "af"), "A gradient.", b"wav")
+    assert cache.get(cache.key_for(_jpeg(shift=3, quality=70), "what is this", "m", "af"))["text"] == "A gradient."
+    assert cache.get(cache.key_for(_jpeg(shift=3, quality=70), "read the label", "m", "af")) is None
+    assert cache.get(cache.key_for(_jpeg(flip=True), "what is this", "m", "af")) is None
+    assert cache.stats()["near_hits"] == 1
+
+def test_near_matching_is_off_by_default():
+    cache = ResponseCache(disk_dir=None)
+    cache.put(cache.key_for(_jpeg(), "what is this", "m", "af"), "A gradient.", b"wav")
+    assert cache.get(cache.key_for(_jpeg(shift=3, quality=70), "what is this", "m", "af")) is None
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    cache = ResponseCache(disk_dir=str(tmp_path))
+    cache.put(cache.key_for(_jpeg(), "what is this", "m", "af"), "A gradient.", b"wav")
+    restarted = ResponseCache(disk_dir=str(tmp_path))
+    key = restarted.key_for(_jpeg(), "what is this", "m", "af")
+    assert restarted.get(key) == {"text": "A gradient.", "audio": b"wav"}
+    assert restarted.get(key) is not None
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1)
+    assert stats["disk_bytes"] == sum(os.path.getsize(tmp_path / name) for name in os.listdir(tmp_path))
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    disk = DiskTier(str(tmp_path), max_bytes=250)
+    for key in ("a", "b"):
+        disk.put(key, "t", b"x" * 100)
+    # "a" is read after "b" was written, so "b" goes first
+    past = time.time() - 60
+    os.utime(tmp_path / "b.json", (past, past))
+    os.utime(tmp_path / "a.json", (past - 60, past - 60))
+    assert disk.get("a") is not None
+    disk.put("c", "t", b"x" * 100)
+    assert disk.get("b") is None
+    assert disk.get("a") is not None and disk.get("c") is not None
+    assert disk.nbytes <= 250
+    assert sorted(os.listdir(tmp_path)) == ["a.json", "a.wav", "c.json", "c.wav"]
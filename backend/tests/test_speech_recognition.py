@@ -0,0 +1,118 @@
+from utils import speech_recognition
+from utils.speech_recognition import BatchScheduler, SAMPLE_RATE
+from types import SimpleNamespace
+import numpy as np
+import pytest
+
+class _Pipeline:
+    # Stands in for BatchedInferencePipeline: one segment per clip, named after the clip's start
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = []
+
+    def transcribe(self, audio, clip_timestamps, **kwargs):
+        self.calls.append((len(audio), clip_timestamps))
+        if self.fail:
+            raise RuntimeError("out of memory")
+        return iter([SimpleNamespace(start=round(c["start"], 3), text=f"<{c['start']:g}>") for c in clip_timestamps]), None
+
+def _scheduler(pipeline, max_batch_size=3, max_wait_ms=1000):
+    scheduler = BatchScheduler(None, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    scheduler.pipeline = pipeline
+    return scheduler
+
+def _seconds(n):
+    return np.ones(int(n * SAMPLE_RATE), dtype=np.float32)
+
+def test_concurrent_requests_share_one_batch_and_get_their_own_clips(monkeypatch):
+    monkeypatch.setattr(speech_recognition, "STT_VAD_FILTER", False)
+    monkeypatch.setattr(speech_recognition, "CHUNK_SECONDS", 1)
+    pipeline = _Pipeline()
+    scheduler = _scheduler(pipeline)
+    futures = [scheduler.submit(_seconds(n)) for n in (2, 0.5, 1)]
+    assert [f.result(timeout=5) for f in futures] == ["<0><1>", "<2>", "<2.5>"]
+    # Laid end to end, with every clip inside a single request
+    assert pipeline.calls == [(int(3.5 * SAMPLE_RATE), [{"start": 0, "end": 1}, {"start": 1, "end": 2}, {"start": 2, "end": 2.5}, {"start": 2.5, "end": 3.5}])]
+    assert scheduler.stats()["batches"] == 1
+    assert scheduler.stats()["avg_batch_size"] == 3
+
+def test_batch_is_cut_at_max_batch_size():
+    pipeline = _Pipeline()
+    scheduler = _scheduler(pipeline, max_batch_size=2, max_wait_ms=100)
+    futures = [scheduler.submit(_seconds(1)) for _ in range(3)]
+    assert [f.result(timeout=5) for f in futures] == ["<0>", "<1>", "<0>"]
+    assert len(pipeline.calls) == 2
+
+def test_failed_batch_fails_every_request():
+    scheduler = _scheduler(_Pipeline(fail=True), max_batch_size=2)
+    futures = [scheduler.submit(_seconds(1)) for _ in range(2)]
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert scheduler.stats()["batches"] == 0
+
+def test_request_without_speech_is_empty(monkeypatch):
+    monkeypatch.setattr(speech_recognition, "STT_VAD_FILTER", True)
+    monkeypatch.setattr(speech_recognition, "speech_timestamps", lambda audio, min_silence_ms: [])
+    pipeline = _Pipeline()
+    assert _scheduler(pipeline, max_batch_size=1).transcribe(_seconds(1)) == ""
+    assert pipeline.calls == []
+
+def _segment(text="hello", avg_logprob=-0.2, no_speech_prob=0.1, compression_ratio=1.5):
+    return SimpleNamespace(text=text, avg_logprob=avg_logprob, no_speech_prob=no_speech_prob, compression_ratio=compression_ratio)
+
+def test_confidence_checks_every_segment():
+    assert speech_recognition._confident([_segment(), _segment()])
+    assert speech_recognition._confident([])
+    assert not speech_recognition._confident([_segment(), _segment(avg_logprob=-1.2)])
+    assert not speech_recognition._confident([_segment(no_speech_prob=0.9)])
+    # Silence that produced no text is fine
+    assert speech_recognition._confident([_segment(text=" ", no_speech_prob=0.9)])
+    assert not speech_recognition._confident([_segment(compression_ratio=3.1)])
+
+class _Model:
+    def __init__(self, segments):
+        self.segments = segments
+        self.calls = []
+
+    def transcribe(self, audio, **kwargs):
+        self.calls.append(kwargs)
+        return iter(self.segments), None
+
+@pytest.fixture
+def cascade(monkeypatch):
+    monkeypatch.setattr(speech_recognition, "require", lambda name: None)
+    monkeypatch.setattr(speech_recognition, "cascade_stats", dict.fromkeys(speech_recognition.cascade_stats, 0))
+    def install(fast_segments):
+        fast, accurate = _Model(fast_segments), _Model([_segment(" from the large model")])
+        monkeypatch.setattr(speech_recognition, "fast_model", fast)
+        monkeypatch.setattr(speech_recognition, "model", accurate)
+        return fast, accurate
+    return install
+
+def test_confident_fast_pass_is_accepted(cascade):
+    fast, accurate = cascade([_segment(" from the small model")])
+    assert speech_recognition.transcribe_audio(_seconds(1), initial_prompt="earlier") == " from the small model"
+    assert accurate.calls == []
+    assert fast.calls[0]["initial_prompt"] == "earlier"
+    assert speech_recognition.cascade_stats["accepted"] == 1
+
+def test_low_confidence_escalates_to_the_large_model(cascade):
+    fast, accurate = cascade([_segment(" mumble", avg_logprob=-1.5)])
+    assert speech_recognition.transcribe_audio(_seconds(1), beam_size=4) == " from the large model"
+    assert accurate.calls[0]["beam_size"] == 4
+    assert speech_recognition.cascade_stats["escalated"] == 1
+
+def test_quality_picks_one_model(cascade):
+    fast, accurate = cascade([_segment(" mumble", avg_logprob=-1.5)])
+    assert speech_recognition.transcribe_audio(_seconds(1), quality="fast") == " mumble"
+    assert accurate.calls == []
+    assert speech_recognition.transcribe_audio(_seconds(1), quality="accurate") == " from the large model"
+    assert len(fast.calls) == 1
+    assert (speech_recognition.cascade_stats["fast_only"], speech_recognition.cascade_stats["accurate_only"]) == (1, 1)
+
+def test_without_a_cascade_model_everything_goes_to_the_large_model(cascade, monkeypatch):
+    cascade([])
+    monkeypatch.setattr(speech_recognition, "fast_model", None)
+    assert speech_recognition.transcribe_audio(_seconds(1), quality="fast") == " from the large model"
+    assert sum(speech_recognition.cascade_stats.values()) == 0
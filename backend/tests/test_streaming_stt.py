@@ -0,0 +1,23 @@
+from utils.streaming_stt import StreamingTranscriber
+import numpy as np
+
+RATE = 16000
+
+def _voiced(audio, min_silence_ms):
+    # Fake VAD: one region spanning the non-zero samples
+    voiced = np.flatnonzero(audio)
+    return [{"start": int(voiced[0]), "end": int(voiced[-1]) + 1}] if len(voiced) else []
+
+def test_utterance_is_final_after_silence_and_partial_before():
+    calls = []
+    def transcribe(audio, beam_size, prompt, quality):
+        calls.append((len(audio), quality))
+        return f"{len(audio) // RATE}s"
+
+    transcriber = StreamingTranscriber(transcribe, _voiced, partial_seconds=1, silence_ms=500, quality="accurate")
+    transcriber.add(np.ones(2 * RATE, dtype=np.float32))
+    assert transcriber.step() == [{"type": "partial", "text": "2s"}]
+    transcriber.add(np.zeros(RATE, dtype=np.float32))
+    assert transcriber.step() == [{"type": "final", "text": "2s", "start": 0.0, "end": 2.0}]
+    assert calls == [(2 * RATE, "fast"), (2 * RATE, "accurate")]
+    assert transcriber.text == "2s"
@@ -0,0 +1,47 @@
+from starlette.requests import Request
+from utils import uploads
+from utils.uploads import read_upload, UploadTooLargeError
+import asyncio
+import pytest
+
+BOUNDARY = "xyz"
+
+def _request(content_type, chunks):
+    # A chunked request: no Content-Length, the body arrives in pieces
+    messages = [{"type": "http.request", "body": chunk, "more_body": True} for chunk in chunks]
+    messages.append({"type": "http.request", "body": b"", "more_body": False})
+    received = []
+
+    async def receive():
+        received.append(1)
+        return messages.pop(0)
+
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": [(b"content-type", content_type.encode())], "query_string": b"voice=af"}
+    return Request(scope, receive), received
+
+def _multipart(data):
+    return (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"stream\"\r\n\r\ntrue\r\n"
+            f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+async def _read(request, field):
+    async with read_upload(request, field) as (file, fields):
+        return (file.read() if file else None), fields
+
+def test_multipart_upload():
+    request, _ = _request(f"multipart/form-data; boundary={BOUNDARY}", [_multipart(b"jpeg bytes")])
+    assert asyncio.run(_read(request, "image")) == (b"jpeg bytes", {"stream": "true"})
+
+def test_raw_upload_takes_fields_from_the_query():
+    request, _ = _request("application/octet-stream", [b"jpeg ", b"bytes"])
+    assert asyncio.run(_read(request, "image")) == (b"jpeg bytes", {"voice": "af"})
+
+@pytest.mark.parametrize("content_type", [f"multipart/form-data; boundary={BOUNDARY}", "application/octet-stream"])
+def test_chunked_upload_stops_at_the_limit(monkeypatch, content_type):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 1000)
+    body = _multipart(b"x" * 5000)
+    request, received = _request(content_type, [body[i:i + 100] for i in range(0, len(body), 100)])
+    with pytest.raises(UploadTooLargeError):
+        asyncio.run(_read(request, "image"))
+    # Reading stopped at the chunk that crossed the limit
+    assert len(received) == 11
@@ -0,0 +1,20 @@
+# Fixed answers spoken in place of Gemini's. They live apart from utils.core so TTS workers can
+# precompute their audio without a Gemini client
+ERROR_PREFIX = "Sorry, I couldn't process that image."
+
+class FallbackAnswer(str):
+    """Text spoken in place of Gemini's answer; never cached or kept in a session's history."""
+
+# Fixed fallback answers, so their audio can be synthesized once at startup
+ERROR_MESSAGE = FallbackAnswer(f"{ERROR_PREFIX} Please try again.")
+UNAVAILABLE_MESSAGE = FallbackAnswer(f"{ERROR_PREFIX} The service is busy, please try again in a moment.")
+EMPTY_ANSWER_MESSAGE = FallbackAnswer("Sorry, I couldn't find anything to describe in that image.")
+FALLBACK_MESSAGES = [ERROR_MESSAGE, UNAVAILABLE_MESSAGE, EMPTY_ANSWER_MESSAGE]
+
+def is_error_answer(text: str) -> bool:
+    # Checks the type, not the wording: Gemini's own text can start like an error message
+    return not text or isinstance(text, FallbackAnswer)
+
+def is_complete_answer(parts) -> bool:
+    # Streamed pieces of one answer; a stream that failed midway ends in a FallbackAnswer after some real text
+    return bool(parts) and not any(is_error_answer(part) for part in parts)
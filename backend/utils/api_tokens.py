@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from uuid import uuid4
+import base64
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+load_dotenv()
+
+# "opaque" keeps the database-backed keys; "signed" issues tokens that are verified in process
+API_KEY_MODE = os.getenv("API_KEY_MODE", "opaque")
+API_TOKEN_TTL = float(os.getenv("API_TOKEN_TTL", str(30 * 24 * 3600)))
+REVOCATION_SYNC_INTERVAL = float(os.getenv("REVOCATION_SYNC_INTERVAL", "30"))
+TOKEN_PREFIX = "v1"
+
+def _signing_keys():
+    # API_TOKEN_KEYS="kid1:secret1,kid2:secret2" allows rotation: new tokens use API_TOKEN_KEY_ID,
+    # tokens signed with any other listed key still verify until they expire
+    keys = {}
+    for item in filter(None, os.getenv("API_TOKEN_KEYS", "").split(",")):
+        kid, _, secret = item.strip().partition(":")
+        if secret:
+            keys[kid] = secret.encode()
+    if not keys and os.getenv("API_KEY_SECRET"):
+        keys["default"] = os.getenv("API_KEY_SECRET").encode()
+    # Signed tokens are trusted without a database lookup, so a guessable key would let anyone mint one
+    if API_KEY_MODE == "signed" and not keys:
+        raise RuntimeError("API_KEY_MODE=signed requires API_TOKEN_KEYS or API_KEY_SECRET")
+    return keys
+
+SIGNING_KEYS = _signing_keys()
+SIGNING_KEY_ID = os.getenv("API_TOKEN_KEY_ID") or next(iter(SIGNING_KEYS), None)
+if API_KEY_MODE == "signed" and SIGNING_KEY_ID not in SIGNING_KEYS:
+    raise RuntimeError(f"API_TOKEN_KEY_ID {SIGNING_KEY_ID} is not in API_TOKEN_KEYS")
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(kid: str, message: str) -> str:
+    return _b64encode(hmac.new(SIGNING_KEYS[kid], message.encode(), hashlib.sha256).digest())
+
+def is_signed_token(token: str) -> bool:
+    return token.startswith(TOKEN_PREFIX + ".")
+
+def issue_token(user_id: str, username: str, email: str, ttl=API_TOKEN_TTL) -> str:
+    """v1.<key id>.<base64url JSON claims>.<base64url HMAC-SHA256 of the first three parts>"""
+    now = time.time()
+    claims = {"uid": user_id, "sub": username, "email": email, "jti": uuid4().hex, "iat": round(now, 3), "exp": int(now + ttl)}
+    message = f"{TOKEN_PREFIX}.{SIGNING_KEY_ID}.{_b64encode(json.dumps(claims, separators=(',', ':')).encode())}"
+    return f"{message}.{_sign(SIGNING_KEY_ID, message)}"
+
+def decode_token(token: str):
+    # Returns the claims of an authentic, unexpired token, otherwise None
+    try:
+        prefix, kid, payload, signature = token.split(".")
+        if prefix != TOKEN_PREFIX or kid not in SIGNING_KEYS:
+            return None
+        if not hmac.compare_digest(_sign(kid, f"{prefix}.{kid}.{payload}"), signature):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) <= time.time():
+        return None
+    return claims
+
+class RevocationList:
+    """In-process copy of the revocation collection, refreshed every `interval` seconds.
+
+    A document either revokes one token ({"jti": ...}, e.g. inserted by an operator) or every token
+    a user was issued before a point in time ({"user_id": ..., "not_before": ...}). Documents carry `expires_at`, after
+    which the tokens they cover have expired anyway and a TTL index removes them.
+    """
+
+    def __init__(self, collection, interval=REVOCATION_SYNC_INTERVAL):
+        self.collection = collection
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._jtis = set()
+        self._not_before = {}
+        # Local revocations made while a sync is reading, so the swap cannot drop them
+        self._recent = []
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_sync = None
+        self.sync_errors = 0
+
+    def is_revoked(self, claims) -> bool:
+        with self._lock:
+            return claims["jti"] in self._jtis or claims["iat"] < self._not_before.get(claims["uid"], 0)
+
+    @staticmethod
+    def _add(jtis, not_before, doc):
+        if doc.get("jti"):
+            jtis.add(doc["jti"])
+        if doc.get("user_id"):
+            not_before[doc["user_id"]] = max(not_before.get(doc["user_id"], 0), doc["not_before"])
+
+    def _add_local(self, doc):
+        with self._lock:
+            self._add(self._jtis, self._not_before, doc)
+            self._recent.append(doc)
+
+    def revoke_user(self, user_id: str):
+        doc = {"user_id": user_id, "not_before": round(time.time(), 3), "expires_at": datetime.now(timezone.utc) + timedelta(seconds=API_TOKEN_TTL)}
+        self.collection.insert_one(dict(doc))
+        self._add_local(doc)
+
+    def sync(self):
+        # Read outside the lock so request-path checks keep running; on error the last good copy stays in place
+        with self._lock:
+            self._recent = []
+        jtis, not_before = set(), {}
+        for doc in self.collection.find({"expires_at": {"$gt": datetime.now(timezone.utc)}}, {"_id": 0}):
+            self._add(jtis, not_before, doc)
+        with self._lock:
+            for doc in self._recent:
+                self._add(jtis, not_before, doc)
+            self._jtis, self._not_before = jtis, not_before
+        self.last_sync = time.time()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                print(f"Revocation list sync error: {str(e)}")
+
+    def start(self):
+        try:
+            self.sync()
+        except Exception as e:
+            self.sync_errors += 1
+            print(f"Revocation list sync error: {str(e)}")
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="revocation-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "revoked_tokens": len(self._jtis),
+                "revoked_users": len(self._not_before),
+                "last_sync": self.last_sync,
+                "sync_errors": self.sync_errors,
+            }
@@ -0,0 +1,170 @@
+from dotenv import load_dotenv
+from uuid import uuid4
+import os
+import threading
+import time
+load_dotenv()
+
+ARTIFACT_BACKEND = os.getenv("ARTIFACT_BACKEND", "memory")
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "./audio")
+ARTIFACT_TTL = float(os.getenv("ARTIFACT_TTL", "60"))
+ARTIFACT_JANITOR_INTERVAL = float(os.getenv("ARTIFACT_JANITOR_INTERVAL", "30"))
+
+class MemoryBackend:
+    # Responses carry their own copy of the bytes, so an artifact is dropped once its last response is built
+    drop_when_released = True
+
+    def __init__(self):
+        self._data = {}
+
+    def write(self, artifact_id, data: bytes):
+        self._data[artifact_id] = data
+
+    def read(self, artifact_id) -> bytes:
+        return self._data[artifact_id]
+
+    def delete(self, artifact_id):
+        self._data.pop(artifact_id, None)
+
+    def cleanup_orphans(self, known, max_age):
+        pass
+
+class DiskBackend:
+    """One file per artifact in `directory` (point it at a tmpfs mount to keep it off disk)."""
+
+    drop_when_released = False
+
+    def __init__(self, directory, suffix=".wav"):
+        self.directory = directory
+        self.suffix = suffix
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, artifact_id):
+        return os.path.join(self.directory, f"{artifact_id}{self.suffix}")
+
+    def write(self, artifact_id, data: bytes):
+        # Write to a temp name and rename, so a reader never sees a partial file
+        tmp = self.path(artifact_id) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, self.path(artifact_id))
+
+    def read(self, artifact_id) -> bytes:
+        with open(self.path(artifact_id), "rb") as f:
+            return f.read()
+
+    def delete(self, artifact_id):
+        try:
+            os.unlink(self.path(artifact_id))
+        except FileNotFoundError:
+            pass
+
+    def cleanup_orphans(self, known, max_age):
+        # Files left behind by a crashed or restarted process. Other workers share the directory, so only
+        # files older than any artifact's lifetime are removed; theirs are still fresh
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            artifact_id = name.split(".", 1)[0]
+            path = os.path.join(self.directory, name)
+            try:
+                if artifact_id not in known and os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Failed to delete {name}. Reason: {e}")
+
+class ArtifactStore:
+    """Short-lived response artifacts with per-artifact expiry and reference counting.
+
+    An artifact is only deleted once it has expired and no response still holds a reference
+    to it. Deletion is done by a single periodic janitor instead of per-request sweeps; in-memory
+    artifacts are also dropped as soon as their last reference is released.
+    """
+
+    def __init__(self, backend, ttl=ARTIFACT_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._stop = threading.Event()
+        self._janitor = None
+        self.deleted = 0
+
+    def put(self, data: bytes, ttl=None) -> str:
+        artifact_id = uuid4().hex
+        self.backend.write(artifact_id, data)
+        with self._lock:
+            self._entries[artifact_id] = {
+                "expires_at": time.monotonic() + (self.ttl if ttl is None else ttl),
+                "refs": 0,
+                "size": len(data),
+            }
+        return artifact_id
+
+    def acquire(self, artifact_id):
+        with self._lock:
+            self._entries[artifact_id]["refs"] += 1
+
+    def release(self, artifact_id):
+        with self._lock:
+            entry = self._entries.get(artifact_id)
+            if entry is None:
+                return
+            entry["refs"] -= 1
+            if entry["refs"] > 0 or not self.backend.drop_when_released:
+                return
+            del self._entries[artifact_id]
+            self.deleted += 1
+        self.backend.delete(artifact_id)
+
+    def read(self, artifact_id) -> bytes:
+        return self.backend.read(artifact_id)
+
+    def path(self, artifact_id):
+        return self.backend.path(artifact_id) if isinstance(self.backend, DiskBackend) else None
+
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if e["expires_at"] <= now and e["refs"] <= 0]
+            for artifact_id in expired:
+                del self._entries[artifact_id]
+            self.deleted += len(expired)
+        for artifact_id in expired:
+            self.backend.delete(artifact_id)
+        return len(expired)
+
+    def _run_janitor(self, interval):
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Artifact janitor error: {str(e)}")
+
+    def start_janitor(self, interval=ARTIFACT_JANITOR_INTERVAL):
+        with self._lock:
+            known = set(self._entries)
+        self.backend.cleanup_orphans(known, self.ttl)
+        if self._janitor is None:
+            self._stop.clear()
+            self._janitor = threading.Thread(target=self._run_janitor, args=(interval,), name="artifact-janitor", daemon=True)
+            self._janitor.start()
+
+    def stop_janitor(self):
+        self._stop.set()
+        if self._janitor is not None:
+            self._janitor.join(timeout=5)
+            self._janitor = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self.backend).__name__,
+                "count": len(self._entries),
+                "bytes": sum(e["size"] for e in self._entries.values()),
+                "in_use": sum(1 for e in self._entries.values() if e["refs"] > 0),
+                "deleted": self.deleted,
+            }
+
+artifact_store = ArtifactStore(DiskBackend(ARTIFACT_DIR) if ARTIFACT_BACKEND == "disk" else MemoryBackend())
@@ -1,15 +1,102 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+import asyncio
+import functools
 import os
 import hashlib
+import threading
+import time
 from datetime import datetime
 from typing import Dict, Any
+from utils.cache import TTLCache
+from utils.executor import BoundedExecutor
+from utils.passwords import hash_password, verify_password, needs_rehash, dummy_verify
+from utils.api_tokens import API_KEY_MODE, RevocationList, issue_token, decode_token, is_signed_token
 
 load_dotenv()
 
 db_url = os.getenv("DB_URI")
 db_name = os.getenv("DB_NAME")
 coll_name = os.getenv("USER_COLLECTION")
+revoked_coll_name = os.getenv("REVOKED_TOKEN_COLLECTION", "revoked_tokens")
+api_key_cache_size = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+api_key_cache_ttl = float(os.getenv("API_KEY_CACHE_TTL", "300"))
+api_key_negative_ttl = float(os.getenv("API_KEY_NEGATIVE_TTL", "30"))
+# "mongo", or "memory" for an in-process mongomock stand-in (local runs and tests)
+db_backend = os.getenv("DB_BACKEND", "mongo")
+db_executor_workers = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+# Password hashing is deliberately slow, so /register and /login get their own bounded pool
+kdf_executor = BoundedExecutor("kdf", int(os.getenv("KDF_WORKERS", "2")), int(os.getenv("KDF_QUEUE_SIZE", "16")))
+
+def _client_options() -> Dict[str, Any]:
+    return {
+        "maxPoolSize": int(os.getenv("DB_MAX_POOL_SIZE", "50")),
+        "minPoolSize": int(os.getenv("DB_MIN_POOL_SIZE", "0")),
+        "maxIdleTimeMS": int(os.getenv("DB_MAX_IDLE_TIME_MS", "300000")),
+        "waitQueueTimeoutMS": int(os.getenv("DB_WAIT_QUEUE_TIMEOUT_MS", "2000")),
+        "connectTimeoutMS": int(os.getenv("DB_CONNECT_TIMEOUT_MS", "5000")),
+        "serverSelectionTimeoutMS": int(os.getenv("DB_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(os.getenv("DB_SOCKET_TIMEOUT_MS", "10000")),
+        "retryWrites": os.getenv("DB_RETRY_WRITES", "true").lower() == "true",
+        "retryReads": os.getenv("DB_RETRY_READS", "true").lower() == "true",
+    }
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    # pymongo has no pool introspection API, so connection counts are tracked from pool events
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def connection_created(self, event):
+        self._add(open=1, created=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1, closed=1)
+
+    def connection_checked_out(self, event):
+        self._add(checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+    def connection_check_out_failed(self, event):
+        self._add(checkout_failures=1)
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "open": self.open,
+                "checked_out": self.checked_out,
+                "created": self.created,
+                "closed": self.closed,
+                "checkout_failures": self.checkout_failures,
+            }
+
+def _create_client(pool_stats: PoolStats):
+    if db_backend == "memory":
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError("DB_BACKEND=memory requires the mongomock package")
+        return mongomock.MongoClient()
+    return MongoClient(db_url, event_listeners=[pool_stats], **_client_options())
 
 class UserManager:
     _instance = None
@@ -23,24 +110,65 @@ class UserManager:
     def __init__(self):
         if not self._initialized:
             try:
-                self.client = MongoClient(db_url)
-                self.db = self.client[db_name]
+                # Connecting is lazy; indexes are created by ensure_indexes() at startup
+                self.pool_stats = PoolStats()
+                self.client = _create_client(self.pool_stats)
+                self.db = self.client[db_name or "drishti"]
                 self.collection = self.db.users
-                self.collection.create_index("username", unique=True)
-                self.collection.create_index("email", unique=True)
-                self.collection.create_index("api_key")
+                # Validated keys and rejected keys, so repeat requests skip MongoDB
+                self.api_key_cache = TTLCache(maxsize=api_key_cache_size, ttl=api_key_cache_ttl)
+                self.revocations = RevocationList(self.db[revoked_coll_name])
                 self._initialized = True
             except Exception as e:
                 print(f"Database initialization error: {str(e)}")
                 raise
     
-    def _hash_password(self, password: str) -> str:
-        return hashlib.sha256(password.encode()).hexdigest()
-    
+    def ensure_indexes(self):
+        self.collection.create_index("username", unique=True)
+        self.collection.create_index("email", unique=True)
+        self.collection.create_index("api_key")
+        self.revocations.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    def health(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            self.client.admin.command("ping")
+            status = {"success": True, "ping_ms": (time.perf_counter() - start) * 1000}
+        except Exception as e:
+            status = {"success": False, "message": f"Database ping failed: {str(e)}"}
+        status["backend"] = db_backend
+        status["pool"] = self.pool_stats.as_dict()
+        status["api_key_cache"] = self.api_key_cache_stats()
+        status["api_key_mode"] = API_KEY_MODE
+        status["revocations"] = self.revocations.stats()
+        return status
+
     def _generate_api_key(self, username: str) -> str:
         secret = os.getenv("API_KEY_SECRET", "default_secret")
         key_base = f"{username}:{secret}:{datetime.now().strftime('%Y%m%d')}"
         return hashlib.sha256(key_base.encode()).hexdigest()
+
+    def _issue_api_key(self, user: Dict[str, Any]) -> str:
+        # In signed mode a fresh token is issued on every login; the stored opaque key keeps working either way
+        if API_KEY_MODE == "signed":
+            return issue_token(str(user["_id"]), user["username"], user.get("email"))
+        return user.get("api_key")
+
+    def _check_credentials(self, username: str, password: str):
+        # Returns (user, None) on success, or (None, error result)
+        user = self.collection.find_one({"username": username})
+        if not user:
+            dummy_verify(password)
+            return None, {
+                "success": False,
+                "message": "User not found"
+            }
+        if not verify_password(password, user.get("password_hash")):
+            return None, {
+                "success": False,
+                "message": "Invalid password"
+            }
+        return user, None
     
     def add_user(self, username: str, email: str, password: str) -> Dict[str, Any]:
         try:
@@ -55,7 +183,7 @@ class UserManager:
             api_key = self._generate_api_key(username)
             user_doc = {
                 "username": username,
-                "password_hash": self._hash_password(password),
+                "password_hash": hash_password(password),
                 "email": email,
                 "api_key": api_key,
                 "created_at": datetime.now(),
@@ -64,11 +192,12 @@ class UserManager:
             
             # Insert the user
             self.collection.insert_one(user_doc)
+            self.invalidate_api_key(api_key)
             
             return {
                 "success": True,
                 "message": "User created successfully",
-                "api_key": api_key
+                "api_key": self._issue_api_key(user_doc)
             }
         except Exception as e:
             return {
@@ -78,36 +207,26 @@ class UserManager:
     
     def authenticate_user(self, username: str, password: str) -> Dict[str, Any]:
         try:
-            # Find the user
-            user = self.collection.find_one({"username": username})
-            if not user:
-                return {
-                    "success": False,
-                    "message": "User not found"
-                }
-            
-            # Check password
-            password_hash = self._hash_password(password)
-            if password_hash != user.get("password_hash"):
-                return {
-                    "success": False,
-                    "message": "Invalid password"
-                }
+            # Find the user and check the password
+            user, error = self._check_credentials(username, password)
+            if error:
+                return error
                 
-            # Update last login time
+            # Update last login time, upgrading legacy or outdated hashes while the plaintext is at hand
+            update_fields = {"last_login": datetime.now()}
+            if needs_rehash(user["password_hash"]):
+                update_fields["password_hash"] = hash_password(password)
             self.collection.update_one(
                 {"_id": user["_id"]},
                 {
-                    "$set": {
-                        "last_login": datetime.now()
-                    }
+                    "$set": update_fields
                 }
             )
             
             return {
                 "success": True,
                 "message": "Authentication successful",
-                "api_key": user.get("api_key"),
+                "api_key": self._issue_api_key(user),
                 "username": user["username"],
                 "email": user["email"]
             }
@@ -117,24 +236,64 @@ class UserManager:
                 "message": f"Authentication error: {str(e)}"
             }
     
+    def _check_signed_token(self, token: str) -> Dict[str, Any]:
+        # Verified entirely in process: signature, expiry and the synced revocation list
+        claims = decode_token(token)
+        if claims is None:
+            return {
+                "success": False,
+                "message": "Invalid API key"
+            }
+        if self.revocations.is_revoked(claims):
+            return {
+                "success": False,
+                "message": "API key has been revoked"
+            }
+        return {
+            "success": True,
+            "message": "API key is valid",
+            "user_id": claims["uid"],
+            "username": claims["sub"],
+            "email": claims["email"]
+        }
+
     def check_api_key(self, api_key: str) -> Dict[str, Any]:
         try:
-            # Find user with this API key
+            if API_KEY_MODE == "signed" and is_signed_token(api_key):
+                return self._check_signed_token(api_key)
+
+            cached = self.api_key_cache.get(api_key)
+            if cached is not None:
+                return dict(cached)
+            return self._lookup_api_key(api_key)
+        except Exception as e:
+            return {
+                "success": False,
+                "message": f"Error checking API key: {str(e)}"
+            }
+
+    def _lookup_api_key(self, api_key: str) -> Dict[str, Any]:
+        # Cache miss: one MongoDB query, whose result (valid or not) is cached
+        try:
             user = self.collection.find_one({"api_key": api_key})
             if not user:
-                return {
+                result = {
                     "success": False,
                     "message": "Invalid API key"
                 }
+                self.api_key_cache.set(api_key, result, ttl=api_key_negative_ttl)
+                return dict(result)
             
             # Return user info
-            return {
+            result = {
                 "success": True,
                 "message": "API key is valid",
                 "user_id": str(user["_id"]),
                 "username": user["username"],
                 "email": user["email"]
             }
+            self.api_key_cache.set(api_key, result)
+            return dict(result)
         except Exception as e:
             return {
                 "success": False,
@@ -144,9 +303,9 @@ class UserManager:
     def update_user(self, username: str, password: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
         try:
             # First authenticate the user
-            auth_result = self.authenticate_user(username, password)
-            if not auth_result["success"]:
-                return auth_result
+            user, error = self._check_credentials(username, password)
+            if error:
+                return error
             
             # Prepare update fields
             update_fields = {}
@@ -166,7 +325,7 @@ class UserManager:
                 update_fields["email"] = update_data["email"]
             
             if "new_password" in update_data:
-                update_fields["password_hash"] = self._hash_password(update_data["new_password"])
+                update_fields["password_hash"] = hash_password(update_data["new_password"])
             
             # Add any additional fields that are allowed to be updated
             allowed_fields = ["first_name", "last_name", "profile_picture"]
@@ -180,6 +339,9 @@ class UserManager:
                     {"username": username},
                     {"$set": update_fields}
                 )
+                self.invalidate_api_key(user.get("api_key"))
+                if "password_hash" in update_fields and API_KEY_MODE == "signed":
+                    self.revocations.revoke_user(str(user["_id"]))
                 
                 return {
                     "success": True,
@@ -199,12 +361,15 @@ class UserManager:
     def delete_user(self, username: str, password: str) -> Dict[str, Any]:
         try:
             # First authenticate the user
-            auth_result = self.authenticate_user(username, password)
-            if not auth_result["success"]:
-                return auth_result
+            user, error = self._check_credentials(username, password)
+            if error:
+                return error
             
             # Delete the user
             self.collection.delete_one({"username": username})
+            self.invalidate_api_key(user.get("api_key"))
+            if API_KEY_MODE == "signed":
+                self.revocations.revoke_user(str(user["_id"]))
             
             return {
                 "success": True,
@@ -216,10 +381,56 @@ class UserManager:
                 "message": f"Error deleting user: {str(e)}"
             }
     
+    def invalidate_api_key(self, api_key: str):
+        if api_key:
+            self.api_key_cache.pop(api_key)
+
+    def api_key_cache_stats(self) -> Dict[str, Any]:
+        return self.api_key_cache.stats()
+
     def close_connection(self):
         """Close the MongoDB connection"""
         if hasattr(self, 'client'):
             self.client.close()
 
 
+class AsyncUserManager:
+    """Awaitable facade over UserManager that runs each call on a dedicated thread pool,
+    so MongoDB round trips never block the event loop."""
+
+    _executor = None
+
+    def __init__(self, manager: UserManager = None):
+        self.manager = manager or UserManager()
+        if AsyncUserManager._executor is None:
+            AsyncUserManager._executor = ThreadPoolExecutor(max_workers=db_executor_workers, thread_name_prefix="db")
+
+    async def _call(self, method, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(method, *args))
+
+    async def check_api_key(self, api_key: str) -> Dict[str, Any]:
+        # Signed tokens and cache hits are answered inline without a thread hop
+        if API_KEY_MODE == "signed" and is_signed_token(api_key):
+            return self.manager.check_api_key(api_key)
+        cached = self.manager.api_key_cache.get(api_key)
+        if cached is not None:
+            return dict(cached)
+        # Straight to the query: check_api_key would look in the cache again and count the miss twice
+        return await self._call(self.manager._lookup_api_key, api_key)
+
+    # Calls that hash a password run on the bounded KDF pool and raise QueueFullError when it is saturated
+    async def add_user(self, username: str, email: str, password: str) -> Dict[str, Any]:
+        return await kdf_executor.run(self.manager.add_user, username, email, password)
+
+    async def authenticate_user(self, username: str, password: str) -> Dict[str, Any]:
+        return await kdf_executor.run(self.manager.authenticate_user, username, password)
+
+    async def health(self) -> Dict[str, Any]:
+        return await self._call(self.manager.health)
+
 
+if __name__ == "__main__":
+    # Migration step: python -m utils.auth_manager
+    UserManager().ensure_indexes()
+    print("Indexes created")
@@ -0,0 +1,151 @@
+from dotenv import load_dotenv
+import base64
+import functools
+import hashlib
+import hmac
+import os
+import re
+load_dotenv()
+
+# "scrypt" (standard library), "argon2" (requires argon2-cffi) or "bcrypt" (requires bcrypt)
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "scrypt")
+SCRYPT_N = int(os.getenv("SCRYPT_N", str(2 ** 14)))
+SCRYPT_R = int(os.getenv("SCRYPT_R", "8"))
+SCRYPT_P = int(os.getenv("SCRYPT_P", "1"))
+ARGON2_TIME_COST = int(os.getenv("ARGON2_TIME_COST", "3"))
+ARGON2_MEMORY_COST = int(os.getenv("ARGON2_MEMORY_COST", "65536"))
+ARGON2_PARALLELISM = int(os.getenv("ARGON2_PARALLELISM", "1"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+# Hashes written before the KDF switch: unsalted hex SHA-256
+LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode().rstrip("=")
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + "=" * (-len(data) % 4))
+
+class ScryptHasher:
+    """$scrypt$n=<n>,r=<r>,p=<p>$<salt>$<hash>"""
+
+    name = "scrypt"
+    prefixes = ("$scrypt$",)
+
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+        self.params = {"n": n, "r": r, "p": p}
+
+    def _derive(self, password: str, salt: bytes, n, r, p) -> bytes:
+        # maxmem leaves headroom over the 128 * n * r bytes scrypt needs, so raising the cost works without other changes
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=32)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        digest = self._derive(password, salt, **self.params)
+        params = ",".join(f"{k}={v}" for k, v in self.params.items())
+        return f"$scrypt${params}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def _parse(self, stored: str):
+        _, _, params, salt, digest = stored.split("$")
+        params = {k: int(v) for k, v in (item.split("=") for item in params.split(","))}
+        if params.keys() != {"n", "r", "p"}:
+            raise ValueError(f"Expected scrypt parameters n, r and p, got {', '.join(params)}")
+        return params, _b64decode(salt), _b64decode(digest)
+
+    def verify(self, password: str, stored: str) -> bool:
+        params, salt, digest = self._parse(stored)
+        return hmac.compare_digest(self._derive(password, salt, **params), digest)
+
+    def needs_rehash(self, stored: str) -> bool:
+        return self._parse(stored)[0] != self.params
+
+class Argon2Hasher:
+    name = "argon2"
+    prefixes = ("$argon2",)
+
+    def __init__(self, time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_COST, parallelism=ARGON2_PARALLELISM):
+        from argon2 import PasswordHasher
+        from argon2.exceptions import VerificationError, InvalidHashError
+        self._hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+        self._errors = (VerificationError, InvalidHashError)
+
+    def hash(self, password: str) -> str:
+        return self._hasher.hash(password)
+
+    def verify(self, password: str, stored: str) -> bool:
+        try:
+            return self._hasher.verify(stored, password)
+        except self._errors:
+            return False
+
+    def needs_rehash(self, stored: str) -> bool:
+        return self._hasher.check_needs_rehash(stored)
+
+class BcryptHasher:
+    name = "bcrypt"
+    prefixes = ("$2a$", "$2b$", "$2y$")
+
+    def __init__(self, rounds=BCRYPT_ROUNDS):
+        import bcrypt
+        self._bcrypt = bcrypt
+        self.rounds = rounds
+
+    def hash(self, password: str) -> str:
+        # bcrypt only looks at the first 72 bytes
+        return self._bcrypt.hashpw(password.encode()[:72], self._bcrypt.gensalt(rounds=self.rounds)).decode()
+
+    def verify(self, password: str, stored: str) -> bool:
+        return self._bcrypt.checkpw(password.encode()[:72], stored.encode())
+
+    def needs_rehash(self, stored: str) -> bool:
+        return int(stored.split("$")[2]) != self.rounds
+
+HASHERS = {"scrypt": ScryptHasher, "argon2": Argon2Hasher, "bcrypt": BcryptHasher}
+
+def get_hasher(name: str):
+    if name not in HASHERS:
+        raise ValueError(f"Unknown PASSWORD_HASHER: {name}")
+    try:
+        return HASHERS[name]()
+    except ImportError:
+        raise RuntimeError(f"PASSWORD_HASHER={name} requires the {name} package")
+
+password_hasher = get_hasher(PASSWORD_HASHER)
+
+def _hasher_for(stored: str):
+    if any(stored.startswith(prefix) for prefix in password_hasher.prefixes):
+        return password_hasher
+    # Hashes from a previously configured backend still verify, and are rehashed on the next login
+    for name, cls in HASHERS.items():
+        if any(stored.startswith(prefix) for prefix in cls.prefixes):
+            return get_hasher(name)
+    return None
+
+def hash_password(password: str) -> str:
+    return password_hasher.hash(password)
+
+def verify_password(password: str, stored: str) -> bool:
+    if not stored:
+        return False
+    if LEGACY_SHA256.match(stored):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+    hasher = _hasher_for(stored)
+    try:
+        return hasher is not None and hasher.verify(password, stored)
+    except ValueError as e:
+        # A truncated or hand-edited hash is a failed login, not a server error
+        print(f"Error verifying password hash: {str(e)}")
+        return False
+
+@functools.lru_cache(maxsize=1)
+def _dummy_hash() -> str:
+    return hash_password(os.urandom(16).hex())
+
+def dummy_verify(password: str) -> bool:
+    # Costs as much as a real check, so unknown usernames cannot be told apart by response time
+    verify_password(password, _dummy_hash())
+    return False
+
+def needs_rehash(stored: str) -> bool:
+    hasher = _hasher_for(stored)
+    return hasher is not password_hasher or password_hasher.needs_rehash(stored)
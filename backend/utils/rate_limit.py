@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import math
+import os
+import threading
+import time
+load_dotenv()
+
+AUTH_IP_RATE = float(os.getenv("AUTH_IP_RATE_PER_MINUTE", "30"))
+AUTH_IP_BURST = int(os.getenv("AUTH_IP_BURST", "10"))
+AUTH_USER_RATE = float(os.getenv("AUTH_USER_RATE_PER_MINUTE", "10"))
+AUTH_USER_BURST = int(os.getenv("AUTH_USER_BURST", "5"))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+
+class RateLimitedError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"Too many {name} requests")
+        self.name = name
+        self.retry_after = retry_after
+
+class TokenBucketLimiter:
+    """Per-key token buckets: `burst` requests at once, refilled at `rate_per_minute`.
+
+    Only the `max_keys` most recently seen keys are tracked; a key that falls out starts with a full bucket.
+    """
+
+    def __init__(self, name, rate_per_minute, burst, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def hit(self, key):
+        # Takes one token for `key`, or raises RateLimitedError with the seconds until one is available
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            limited = tokens < 1
+            if not limited:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if limited:
+                self.limited += 1
+                raise RateLimitedError(self.name, max(1, math.ceil((1 - tokens) / self.rate)) if self.rate > 0 else 60)
+            self.allowed += 1
+
+    def stats(self):
+        with self._lock:
+            return {"keys": len(self._buckets), "allowed": self.allowed, "limited": self.limited}
+
+auth_ip_limiter = TokenBucketLimiter("auth", AUTH_IP_RATE, AUTH_IP_BURST)
+auth_user_limiter = TokenBucketLimiter("login", AUTH_USER_RATE, AUTH_USER_BURST)
+
+def rate_limit_stats():
+    return {"auth_ip": auth_ip_limiter.stats(), "auth_user": auth_user_limiter.stats()}
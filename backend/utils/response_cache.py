@@ -0,0 +1,185 @@
+from utils.cache import TTLCache
+from collections import OrderedDict
+from dotenv import load_dotenv
+from PIL import Image
+import hashlib
+import json
+import os
+import re
+import threading
+import io
+load_dotenv()
+
+RESPONSE_CACHE_BYTES = int(os.getenv("RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR") or None
+RESPONSE_CACHE_DISK_BYTES = int(os.getenv("RESPONSE_CACHE_DISK_BYTES", str(512 * 1024 * 1024)))
+# Hamming distance on a 64-bit dHash; 0 turns near-duplicate matching off
+RESPONSE_CACHE_NEAR_DISTANCE = int(os.getenv("RESPONSE_CACHE_NEAR_DISTANCE", "0"))
+NEAR_INDEX_SIZE = 4096
+
+def normalize_query(query: str) -> str:
+    return re.sub(r'\s+', ' ', query).strip().lower().rstrip('?.! ')
+
+def dhash(image_data: bytes) -> int:
+    # 64-bit difference hash: robust to small camera movement, exposure and re-encoding
+    img = Image.open(io.BytesIO(image_data))
+    # JPEGs are decoded at a reduced scale; the hash only needs 9x8 pixels
+    img.draft("L", (64, 64))
+    img = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = img.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+class CacheKey:
+    def __init__(self, image_data: bytes, query: str, model: str, voice: str, near=False):
+        # The context covers everything except the image, so near-duplicate images only match the same question
+        self.context = hashlib.sha256(f"{normalize_query(query)}\0{model}\0{voice}".encode()).hexdigest()
+        self.key = hashlib.sha256(image_data + self.context.encode()).hexdigest()
+        self.phash = None
+        if near:
+            try:
+                self.phash = dhash(image_data)
+            except Exception as e:
+                print(f"Error hashing image: {str(e)}")
+
+class DiskTier:
+    """Directory of <key>.wav + <key>.json files, evicting least recently used once over `max_bytes`."""
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._sizes = {}
+        for name in os.listdir(directory):
+            key, ext = os.path.splitext(name)
+            if ext in (".wav", ".json"):
+                self._sizes[key] = self._sizes.get(key, 0) + os.path.getsize(os.path.join(directory, name))
+        self.nbytes = sum(self._sizes.values())
+
+    def _path(self, key, ext):
+        return os.path.join(self.directory, f"{key}{ext}")
+
+    def get(self, key):
+        try:
+            with open(self._path(key, ".json")) as f:
+                meta = json.load(f)
+            with open(self._path(key, ".wav"), "rb") as f:
+                audio = f.read()
+            os.utime(self._path(key, ".json"))
+            return {"text": meta["text"], "audio": audio}
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, key, text, audio):
+        meta = json.dumps({"text": text}).encode()
+        for ext, data in ((".wav", audio), (".json", meta)):
+            tmp = self._path(key, ext) + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self._path(key, ext))
+        with self._lock:
+            self.nbytes += len(audio) + len(meta) - self._sizes.get(key, 0)
+            self._sizes[key] = len(audio) + len(meta)
+            if self.nbytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        def last_used(key):
+            try:
+                return os.path.getmtime(self._path(key, ".json"))
+            except OSError:
+                return 0
+        for key in sorted(self._sizes, key=last_used):
+            if self.nbytes <= self.max_bytes:
+                break
+            for ext in (".wav", ".json"):
+                try:
+                    os.unlink(self._path(key, ext))
+                except OSError:
+                    pass
+            self.nbytes -= self._sizes.pop(key)
+
+class ResponseCache:
+    """Full /query responses (answer text + WAV bytes) keyed by image content, query, model and voice."""
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_BYTES, ttl=RESPONSE_CACHE_TTL, disk_dir=RESPONSE_CACHE_DIR,
+                 disk_bytes=RESPONSE_CACHE_DISK_BYTES, near_distance=RESPONSE_CACHE_NEAR_DISTANCE):
+        self.memory = TTLCache(maxsize=100000, ttl=ttl, maxbytes=max_bytes,
+                               sizeof=lambda entry: len(entry["audio"]) + len(entry["text"]))
+        self.disk = DiskTier(disk_dir, disk_bytes) if disk_dir else None
+        self.near_distance = near_distance
+        self._near = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"memory_hits": 0, "disk_hits": 0, "near_hits": 0, "misses": 0}
+
+    def key_for(self, image_data, query, model, voice, near=True) -> CacheKey:
+        return CacheKey(image_data, query, model, voice, near=near and self.near_distance > 0)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _lookup(self, key):
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry, "memory_hits"
+        if self.disk is not None:
+            entry = self.disk.get(key)
+            if entry is not None:
+                self.memory.set(key, entry)
+                return entry, "disk_hits"
+        return None, None
+
+    def _nearest(self, cache_key: CacheKey):
+        with self._lock:
+            candidates = [(key, phash) for key, (context, phash) in self._near.items() if context == cache_key.context]
+        best, best_distance = None, self.near_distance + 1
+        for key, phash in candidates:
+            distance = bin(phash ^ cache_key.phash).count("1")
+            if distance < best_distance:
+                best, best_distance = key, distance
+        return best
+
+    def get(self, cache_key: CacheKey):
+        entry, tier = self._lookup(cache_key.key)
+        if entry is None and cache_key.phash is not None:
+            near_key = self._nearest(cache_key)
+            if near_key is not None:
+                entry, _ = self._lookup(near_key)
+                tier = "near_hits" if entry is not None else None
+        self._count(tier or "misses")
+        return entry
+
+    def put(self, cache_key: CacheKey, text: str, audio: bytes):
+        entry = {"text": text, "audio": audio}
+        self.memory.set(cache_key.key, entry)
+        if self.disk is not None:
+            try:
+                self.disk.put(cache_key.key, text, audio)
+            except OSError as e:
+                print(f"Error writing response cache: {str(e)}")
+        if cache_key.phash is not None:
+            with self._lock:
+                self._near[cache_key.key] = (cache_key.context, cache_key.phash)
+                self._near.move_to_end(cache_key.key)
+                while len(self._near) > NEAR_INDEX_SIZE:
+                    self._near.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = sum(counts.values())
+        hits = lookups - counts["misses"]
+        return {
+            **counts,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "memory": self.memory.stats(),
+            "disk_bytes": self.disk.nbytes if self.disk is not None else None,
+        }
+
+response_cache = ResponseCache()
@@ -0,0 +1,106 @@
+from google.genai import types
+from dotenv import load_dotenv
+from uuid import uuid4
+from utils.cache import TTLCache
+from utils import core
+import threading
+import io
+import os
+load_dotenv()
+
+# Sessions expire SESSION_TTL seconds after their last use; the store is per process, so run
+# several workers behind a load balancer with session affinity
+SESSION_TTL = float(os.getenv("SESSION_TTL", "600"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "1000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(64 * 1024 * 1024)))
+# Question/answer pairs replayed to Gemini with each follow-up; older turns are dropped
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "4"))
+# Upload each session image to the Gemini Files API once, so follow-ups reference it by URI
+SESSION_GEMINI_FILES = os.getenv("SESSION_GEMINI_FILES", "false").lower() in ("1", "true", "yes")
+
+class ImageSession:
+    """One preprocessed photo and the conversation about it."""
+
+    def __init__(self, image_data: bytes, mime_type: str, owner=None):
+        self.id = uuid4().hex
+        self.image_data = image_data
+        self.mime_type = mime_type
+        self.owner = owner
+        self.file = None
+        self.history = []
+        self._lock = threading.Lock()
+
+    def image_part(self):
+        if self.file is not None:
+            return types.Part.from_uri(file_uri=self.file.uri, mime_type=self.mime_type)
+        return types.Part.from_bytes(data=self.image_data, mime_type=self.mime_type)
+
+    def request(self, query: str):
+        with self._lock:
+            history = list(self.history)
+        return core.conversation_request(self.image_part(), history, query)
+
+    def add_turn(self, question: str, answer: str):
+        with self._lock:
+            self.history.append((question, answer))
+            del self.history[:-SESSION_MAX_TURNS]
+
+class SessionStore:
+    """Bounded TTL store of image sessions, by count and by total image bytes."""
+
+    def __init__(self, max_count=SESSION_MAX_COUNT, max_bytes=SESSION_MAX_BYTES, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self._sessions = TTLCache(maxsize=max_count, ttl=ttl, maxbytes=max_bytes, sizeof=lambda session: len(session.image_data))
+        self._lock = threading.Lock()
+        self.counts = {"created": 0, "follow_ups": 0, "not_found": 0, "uploaded": 0, "upload_failures": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def create(self, image_data: bytes, mime_type: str, owner=None) -> ImageSession:
+        session = ImageSession(image_data, mime_type, owner)
+        self._sessions.set(session.id, session)
+        self._count("created")
+        return session
+
+    def get(self, session_id: str, owner=None):
+        # Another user's session is reported as missing, not forbidden
+        session = self._sessions.get(session_id)
+        if session is None or session.owner != owner:
+            self._count("not_found")
+            return None
+        # Every use extends the TTL
+        self._sessions.set(session_id, session)
+        if session.history:
+            self._count("follow_ups")
+        return session
+
+    def delete(self, session_id: str, owner=None) -> bool:
+        session = self._sessions.get(session_id)
+        if session is None or session.owner != owner:
+            return False
+        self._sessions.pop(session_id)
+        if session.file is not None:
+            try:
+                core.g_client.files.delete(name=session.file.name)
+            except Exception as e:
+                print(f"Error deleting Gemini file: {str(e)}")
+        return True
+
+    def upload(self, session: ImageSession):
+        # Blocking; runs after the session has been handed out, which keeps sending the bytes inline until it succeeds.
+        # Files the store forgets about expire on Gemini's side after 48 hours
+        try:
+            session.file = core.g_client.files.upload(file=io.BytesIO(session.image_data), config=types.UploadFileConfig(mime_type=session.mime_type))
+            self._count("uploaded")
+        except Exception as e:
+            self._count("upload_failures")
+            print(f"Error uploading session image: {str(e)}")
+
+    def stats(self):
+        stats = self._sessions.stats()
+        with self._lock:
+            return {**stats, **self.counts}
+
+session_store = SessionStore()
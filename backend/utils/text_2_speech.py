@@ -1,21 +1,215 @@
-from kokoro import KPipeline
-import soundfile as sf
+from dotenv import load_dotenv
+from contextlib import contextmanager
+from utils.cache import TTLCache
+from utils.artifacts import artifact_store
+from utils.metrics import timed
+from utils.lifecycle import register, require, ModelUnavailableError
+from utils.tts_engines import make_engine
+from utils.audio import pcm_to_wav, DEFAULT_VOICE
+from utils.answers import FALLBACK_MESSAGES
+import numpy as np
+import os
+import queue
+import threading
+import time
 import torch
-from uuid import uuid4
-pipeline = KPipeline(lang_code='a')
-
-from io import BytesIO
-import base64
-
-base64_audio_list = []
-def tts(text,voice='af_heart',speed=1):
-    pipeline = KPipeline(lang_code='a') 
-    generator = pipeline(
-         text, voice=voice,
-         speed=speed
-     )
-    id = uuid4()
-    for i, (gs, ps, audio) in enumerate(generator):
-        sf.write(f'audio/{id}.wav', audio, 24000)
-        return {'flag':True,'id':id}
-    return {'flag':False}
+load_dotenv()
+
+TTS_POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "2"))
+TTS_ACQUIRE_TIMEOUT = float(os.getenv("TTS_ACQUIRE_TIMEOUT", "30"))
+TTS_LANG_CODES = [c.strip() for c in os.getenv("TTS_LANG_CODES", "a").split(",") if c.strip()]
+TTS_CACHE_BYTES = int(os.getenv("TTS_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+_stats_lock = threading.Lock()
+tts_stats = {
+    "model_load_count": 0,
+    "model_load_seconds": 0.0,
+    "pipeline_load_count": 0,
+    "pipeline_load_seconds": 0.0,
+    "synthesis_count": 0,
+    "synthesis_seconds": 0.0,
+    "pool_waits": 0,
+    "pinned_hits": 0,
+}
+
+def _record(prefix, seconds):
+    with _stats_lock:
+        tts_stats[f"{prefix}_count"] += 1
+        tts_stats[f"{prefix}_seconds"] += seconds
+
+def get_tts_stats():
+    with _stats_lock:
+        stats = dict(tts_stats)
+    stats["engine"] = engine.describe()
+    stats["pools"] = {code: pool.stats() for code, pool in list(_pools.items())}
+    stats["phrase_cache"] = {**phrase_cache.stats(), "pinned": len(_pinned_phrases)}
+    return stats
+
+# Synthesized PCM for repeated phrases, LRU-bounded by bytes.
+# Pinned phrases (canned error/fallback answers) are precomputed at startup and never evicted.
+phrase_cache = TTLCache(maxsize=100000, ttl=float("inf"), maxbytes=TTS_CACHE_BYTES)
+_pinned_phrases = {}
+
+def _phrase_key(text, voice, speed, lang_code=None):
+    return (text.strip(), voice, float(speed), lang_code or lang_code_for_voice(voice))
+
+def _cached_pcm(key):
+    pcm = _pinned_phrases.get(key)
+    if pcm is not None:
+        with _stats_lock:
+            tts_stats["pinned_hits"] += 1
+        return pcm
+    return phrase_cache.get(key)
+
+# TTS_ENGINE (utils.tts_engines) picks the runtime; its weights are loaded once and every pipeline in every pool shares them
+engine = make_engine()
+_model_lock = threading.Lock()
+
+def _load_model():
+    with _model_lock:
+        if not engine.loaded:
+            start = time.perf_counter()
+            engine.load()
+            _record("model_load", time.perf_counter() - start)
+
+class PipelinePool:
+    def __init__(self, lang_code, size=TTS_POOL_SIZE):
+        self.lang_code = lang_code
+        self.size = max(1, size)
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def _create(self):
+        _load_model()
+        start = time.perf_counter()
+        pipeline = engine.pipeline(self.lang_code)
+        _record("pipeline_load", time.perf_counter() - start)
+        return pipeline
+
+    def _take(self, timeout):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            try:
+                return self._create()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        with _stats_lock:
+            tts_stats["pool_waits"] += 1
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No TTS pipeline for lang_code '{self.lang_code}' became free within {timeout}s")
+
+    @contextmanager
+    def acquire(self, timeout=TTS_ACQUIRE_TIMEOUT):
+        pipeline = self._take(timeout)
+        with self._lock:
+            self._in_use += 1
+        try:
+            yield pipeline
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._idle.put(pipeline)
+
+    def stats(self):
+        with self._lock:
+            return {"size": self.size, "created": self._created, "in_use": self._in_use}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def lang_code_for_voice(voice):
+    # Kokoro voice ids are prefixed with their language code, e.g. 'af_heart' -> 'a'
+    return voice[0] if voice else 'a'
+
+def get_pool(lang_code='a'):
+    with _pools_lock:
+        pool = _pools.get(lang_code)
+        if pool is None:
+            pool = _pools[lang_code] = PipelinePool(lang_code)
+        return pool
+
+def warm_up(lang_codes=None, voice=DEFAULT_VOICE):
+    for code in lang_codes or TTS_LANG_CODES:
+        with get_pool(code).acquire() as pipeline:
+            if code == lang_code_for_voice(voice):
+                for _ in engine.synthesize(pipeline, "Ready.", voice, 1):
+                    pass
+
+def _synthesize(text, voice, speed, lang_code=None):
+    # Yields numpy segments, holding a pooled pipeline only while Kokoro is running
+    require("tts")
+    with get_pool(lang_code or lang_code_for_voice(voice)).acquire() as pipeline:
+        generator = engine.synthesize(pipeline, text, voice, speed)
+        while True:
+            start = time.perf_counter()
+            try:
+                audio = next(generator)
+            except StopIteration:
+                break
+            _record("synthesis", time.perf_counter() - start)
+            yield audio
+
+def _to_numpy(audio):
+    if isinstance(audio, torch.Tensor):
+        audio = audio.detach().cpu().numpy()
+    return np.asarray(audio, dtype=np.float32)
+
+def to_pcm16(audio) -> bytes:
+    audio = np.clip(_to_numpy(audio), -1.0, 1.0)
+    return (audio * 32767).astype('<i2').tobytes()
+
+def tts_stream(text,voice=DEFAULT_VOICE,speed=1):
+    # Yields raw 16-bit PCM for each segment as soon as Kokoro produces it
+    key = _phrase_key(text, voice, speed)
+    cached = _cached_pcm(key)
+    if cached is not None:
+        yield cached
+        return
+    chunks = []
+    for audio in _synthesize(text, voice, speed):
+        chunk = to_pcm16(audio)
+        chunks.append(chunk)
+        yield chunk
+    if chunks:
+        phrase_cache.set(key, b''.join(chunks))
+
+def tts_pcm(text,voice=DEFAULT_VOICE,speed=1) -> bytes:
+    with timed("tts_synthesis"):
+        return b''.join(tts_stream(text, voice, speed))
+
+def precompute_phrases(phrases, voice=DEFAULT_VOICE, speed=1):
+    for text in phrases:
+        key = _phrase_key(text, voice, speed)
+        pcm = b''.join(to_pcm16(audio) for audio in _synthesize(text, voice, speed))
+        if pcm:
+            _pinned_phrases[key] = pcm
+
+def tts(text,voice=DEFAULT_VOICE,speed=1):
+    # Stores the WAV in the artifact store and returns its id
+    try:
+        pcm = tts_pcm(text, voice, speed)
+    except ModelUnavailableError:
+        raise
+    except Exception as e:
+        print(f"Error in tts: {str(e)}")
+        return {'flag':False}
+    if not pcm:
+        return {'flag':False}
+    id = artifact_store.put(pcm_to_wav(pcm))
+    return {'flag':True,'id':id}
+
+# Canned answers are synthesized once as part of the warm-up, in whichever process runs Kokoro
+register("tts", _load_model, warm_up, lambda: precompute_phrases(FALLBACK_MESSAGES))
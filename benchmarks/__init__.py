@@ -0,0 +1,7 @@
+"""Benchmarks for the query and transcription pipelines.
+
+Run from the repository root: `python -m benchmarks.load`, `python -m benchmarks.micro`
+and `python -m benchmarks.serve` (see each module for options). Gemini is replaced by a fake
+client with configurable latency and MongoDB by the in-memory store, so runs are reproducible
+and need no network access; Kokoro and Whisper run for real on the local machine.
+"""
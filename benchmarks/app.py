@@ -0,0 +1,57 @@
+from contextlib import asynccontextmanager
+from benchmarks.fakes import FakeGeminiClient
+import asyncio
+import importlib
+import os
+import sys
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APPS = ("backend", "stand_alone")
+
+def load_app(name, llm_latency=0.5, first_token=0.2):
+    """Imports `<name>/main.py` with Gemini replaced by a fake and MongoDB by the in-memory store.
+
+    Both apps import their helpers as `utils.*`, so only one of them can be loaded per process.
+    """
+    if name not in APPS:
+        raise ValueError(f"Unknown app: {name}")
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    os.environ.setdefault("DB_BACKEND", "memory")
+    sys.path.insert(0, os.path.join(ROOT, name))
+    core = importlib.import_module("utils.core")
+    core.g_client = FakeGeminiClient(llm_latency, first_token)
+    return importlib.import_module("main")
+
+@asynccontextmanager
+async def lifespan(app):
+    # Runs the app's startup/shutdown handlers, which an ASGI transport alone doesn't do
+    messages = asyncio.Queue()
+    started, stopped = asyncio.Event(), asyncio.Event()
+    await messages.put({"type": "lifespan.startup"})
+
+    async def send(message):
+        if message["type"].startswith("lifespan.startup"):
+            if message["type"].endswith("failed"):
+                raise RuntimeError(message.get("message", "startup failed"))
+            started.set()
+        elif message["type"].startswith("lifespan.shutdown"):
+            stopped.set()
+
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, messages.get, send))
+    await started.wait()
+    try:
+        yield
+    finally:
+        await messages.put({"type": "lifespan.shutdown"})
+        await stopped.wait()
+        await task
+
+def speech_synthesizer():
+    # The app's own Kokoro pipeline, for realistic STT fixtures
+    from utils.text_2_speech import tts_pcm
+    from utils.audio import TTS_SAMPLE_RATE as SAMPLE_RATE
+
+    def synthesize(text):
+        return np.frombuffer(tts_pcm(text), dtype="<i2").astype(np.float32) / 32767, SAMPLE_RATE
+    return synthesize
@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+ANSWER = (
+    "The image shows a red coffee mug on a wooden desk next to an open laptop. "
+    "A small potted plant sits to the right of the mug. "
+    "The room is well lit by a window in the background."
+)
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+class FakeModels:
+    """Stands in for `client.models` / `client.aio.models` with a fixed answer and configurable latency.
+
+    `latency` is the time to the complete answer; when streaming, `first_token` is the delay
+    before the first chunk and the rest of `latency` is spread across the remaining chunks.
+    """
+
+    def __init__(self, latency=0.5, first_token=0.2, answer=ANSWER, chunk_words=6):
+        self.latency = latency
+        self.first_token = min(first_token, latency)
+        self.answer = answer
+        self.chunk_words = chunk_words
+        self.calls = 0
+
+    def _chunks(self):
+        words = self.answer.split(" ")
+        return [" ".join(words[i:i + self.chunk_words]) + " " for i in range(0, len(words), self.chunk_words)]
+
+class FakeAsyncModels(FakeModels):
+    async def generate_content(self, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return FakeResponse(self.answer)
+
+    async def generate_content_stream(self, **kwargs):
+        self.calls += 1
+        chunks = self._chunks()
+        delay = (self.latency - self.first_token) / max(1, len(chunks) - 1)
+
+        async def stream():
+            await asyncio.sleep(self.first_token)
+            for i, chunk in enumerate(chunks):
+                if i:
+                    await asyncio.sleep(delay)
+                yield FakeResponse(chunk)
+        return stream()
+
+class FakeSyncModels(FakeModels):
+    def generate_content(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        return FakeResponse(self.answer)
+
+class FakeAio:
+    def __init__(self, models):
+        self.models = models
+
+class FakeGeminiClient:
+    """Drop-in for `genai.Client` covering the calls utils/core.py makes."""
+
+    def __init__(self, latency=0.5, first_token=0.2, answer=ANSWER):
+        self.models = FakeSyncModels(latency, first_token, answer)
+        self.aio = FakeAio(FakeAsyncModels(latency, first_token, answer))
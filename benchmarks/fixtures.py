@@ -0,0 +1,52 @@
+import io
+import numpy as np
+import soundfile as sf
+from PIL import Image
+
+# Typical client captures: low-res preview, phone default, full-resolution phone sensor
+IMAGE_SIZES = {"small": (640, 480), "medium": (1920, 1440), "large": (4032, 3024)}
+AUDIO_SECONDS = {"short": 2, "medium": 6, "long": 15}
+SPEECH_TEXT = (
+    "What is in front of me right now? Can you describe the objects on the table, "
+    "and tell me if there is anything I might trip over on the way to the door? "
+)
+
+def image(size="medium", seed=0, quality=90) -> bytes:
+    """Deterministic JPEG with smooth gradients plus noise, so it compresses like a photo rather than a flat colour."""
+    width, height = IMAGE_SIZES[size]
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 24, base.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+def _tone(seconds, sample_rate, seed):
+    # Fallback when no TTS is available: an amplitude-modulated harmonic signal
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    voice = sum(np.sin(2 * np.pi * 140 * k * t) / k for k in range(1, 6))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    return (0.2 * voice * envelope + rng.normal(0, 0.01, len(t))).astype(np.float32)
+
+def audio(length="short", synthesize=None, sample_rate=16000, seed=0) -> bytes:
+    """WAV of roughly AUDIO_SECONDS[length] seconds.
+
+    `synthesize(text) -> (float32 samples, sample rate)` produces real speech (e.g. the app's own Kokoro
+    pipeline), which matters for STT timing because VAD skips non-speech. Without it a synthetic tone is used.
+    """
+    seconds = AUDIO_SECONDS[length]
+    samples = None
+    if synthesize is not None:
+        try:
+            speech, rate = synthesize(SPEECH_TEXT)
+            repeats = int(np.ceil(seconds * rate / max(1, len(speech))))
+            samples, sample_rate = np.tile(speech, repeats)[:int(seconds * rate)], rate
+        except Exception as e:
+            print(f"Speech synthesis for fixtures failed, using a tone: {str(e)}")
+    if samples is None:
+        samples = _tone(seconds, sample_rate, seed)
+    buf = io.BytesIO()
+    sf.write(buf, samples, sample_rate, format="WAV", subtype="PCM_16")
+    return buf.getvalue()
@@ -0,0 +1,184 @@
+"""Load benchmark for /query and /transcribe.
+
+In process (the app is imported with a fake Gemini client and the in-memory user store):
+
+    python -m benchmarks.load --app stand_alone --scenario query --concurrency 8 --requests 200 --output query.json
+
+Over HTTP, against a server started with `python -m benchmarks.serve` (or any deployment):
+
+    python -m benchmarks.load --url http://localhost:8282 --scenario transcribe --server-pid <pid>
+
+In process, httpx's ASGI transport hands back the body only once it is complete, so `ttfb` is only
+meaningful over HTTP; the Server-Timing stage breakdown works in both modes.
+
+Pass `--compare baseline.json` to print the change against an earlier run, and `--fail-on-regression 10`
+to exit non-zero when a latency, throughput or memory figure got more than 10% worse.
+"""
+from benchmarks import fixtures
+from benchmarks.report import percentiles, parse_server_timing, RssSampler, environment, save, compare, print_comparison
+from uuid import uuid4
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import time
+import httpx
+
+SCENARIOS = ("query", "query_stream", "query_upload", "transcribe", "transcribe_upload")
+
+def make_request(scenario, i, image, audio, repeat_query):
+    # A unique question per request keeps the response cache out of the measurement unless --repeat-query is set
+    query = "What is in front of me?" if repeat_query else f"What is in front of me? ({i})"
+    if scenario in ("query", "query_stream"):
+        return {"url": "/query", "json": {"user_input": query, "img_base64": base64.b64encode(image).decode(), "stream": scenario == "query_stream"}}
+    if scenario == "query_upload":
+        return {"url": "/query/upload", "files": {"image": ("image.jpg", image, "image/jpeg")}, "data": {"user_input": query}}
+    if scenario == "transcribe":
+        return {"url": "/transcribe", "json": {"audio": base64.b64encode(audio).decode(), "format": "wav"}}
+    return {"url": "/transcribe/upload", "files": {"audio": ("audio.wav", audio, "audio/wav")}}
+
+async def authenticate(client, api_key=None):
+    # The backend needs an API key; the stand-alone app has no /register and needs none
+    if api_key:
+        return api_key
+    response = await client.post("/register", json={"username": f"bench-{uuid4().hex[:12]}", "email": f"{uuid4().hex[:12]}@bench.local", "password": uuid4().hex})
+    return response.json().get("api_key") if response.status_code == 200 else None
+
+async def timed_request(client, request, api_key):
+    params = {"authorization": api_key} if api_key else None
+    start = time.perf_counter()
+    ttfb = None
+    size = 0
+    try:
+        async with client.stream("POST", request["url"], params=params, json=request.get("json"),
+                                 files=request.get("files"), data=request.get("data")) as response:
+            async for chunk in response.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                size += len(chunk)
+            status = response.status_code
+            stages = parse_server_timing(response.headers.get("server-timing"))
+    except httpx.HTTPError as e:
+        status, stages = type(e).__name__, {}
+    return {"status": status, "latency": time.perf_counter() - start, "ttfb": ttfb, "bytes": size, "stages": stages}
+
+async def drive(client, args, image, audio, api_key):
+    for i in range(args.warmup):
+        await timed_request(client, make_request(args.scenario, -1 - i, image, audio, args.repeat_query), api_key)
+
+    counter = iter(range(args.requests))
+    results = []
+
+    async def worker():
+        for i in counter:
+            results.append(await timed_request(client, make_request(args.scenario, i, image, audio, args.repeat_query), api_key))
+
+    # In process the app's memory is our own; over HTTP it is only known with --server-pid
+    stop = asyncio.Event()
+    sampler = RssSampler(args.server_pid) if args.server_pid or not args.url else None
+    sampling = asyncio.create_task(sampler.run(stop)) if sampler else None
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    wall = time.perf_counter() - start
+    stop.set()
+    if sampling:
+        await sampling
+    return results, wall, sampler
+
+def summarize(args, results, wall, sampler):
+    ok = [r for r in results if r["status"] == 200]
+    statuses = {}
+    for r in results:
+        statuses[str(r["status"])] = statuses.get(str(r["status"]), 0) + 1
+    stage_names = sorted({name for r in ok for name in r["stages"]})
+    return {
+        "meta": {
+            "scenario": args.scenario,
+            "target": args.url or f"in-process:{args.app}",
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "image_size": args.image_size,
+            "audio_length": args.audio_length,
+            "llm_latency": args.llm_latency,
+            "repeat_query": args.repeat_query,
+            **environment(),
+        },
+        "wall_seconds": wall,
+        "throughput_rps": len(ok) / wall if wall else 0.0,
+        "statuses": statuses,
+        "latency": percentiles([r["latency"] for r in ok]),
+        "ttfb": percentiles([r["ttfb"] for r in ok if r["ttfb"] is not None]),
+        "response_bytes": percentiles([r["bytes"] for r in ok]),
+        "rss": sampler.summary() if sampler else None,
+        "stages": {name: percentiles([r["stages"][name] for r in ok if name in r["stages"]]) for name in stage_names},
+    }
+
+def print_summary(summary):
+    print(f"{summary['meta']['scenario']} against {summary['meta']['target']}: "
+          f"{summary['throughput_rps']:.2f} req/s, statuses {summary['statuses']}")
+    rows = [("latency", summary["latency"]), ("ttfb", summary["ttfb"])] + sorted(summary["stages"].items())
+    print(f"{'':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, p in rows:
+        if p:
+            print(f"{name:<24}{p['p50'] * 1000:>10.1f}{p['p95'] * 1000:>10.1f}{p['p99'] * 1000:>10.1f}")
+    if summary["rss"]:
+        print(f"RSS: {summary['rss']['start_mb']:.0f} MB -> peak {summary['rss']['peak_mb']:.0f} MB")
+
+async def main(args):
+    image = fixtures.image(args.image_size)
+    if args.url:
+        audio = fixtures.audio(args.audio_length)
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        async with client:
+            api_key = await authenticate(client, args.api_key)
+            return await drive(client, args, image, audio, api_key)
+
+    from benchmarks.app import load_app, lifespan, speech_synthesizer
+    app = load_app(args.app, args.llm_latency, args.llm_first_token).app
+    async with lifespan(app):
+        audio = fixtures.audio(args.audio_length, speech_synthesizer())
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as client:
+            api_key = await authenticate(client, args.api_key)
+            return await drive(client, args, image, audio, api_key)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--app", choices=("backend", "stand_alone"), default="stand_alone", help="app to run in process")
+    target.add_argument("--url", help="benchmark a running server over HTTP instead")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="query")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--image-size", choices=sorted(fixtures.IMAGE_SIZES), default="medium")
+    parser.add_argument("--audio-length", choices=sorted(fixtures.AUDIO_SECONDS), default="short")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds the fake Gemini takes per answer (in process only)")
+    parser.add_argument("--llm-first-token", type=float, default=0.2, help="seconds to the first streamed chunk (in process only)")
+    parser.add_argument("--repeat-query", action="store_true", help="send the same question every time, so the response cache is hit")
+    parser.add_argument("--api-key", help="existing API key; otherwise a throwaway user is registered when /register exists")
+    parser.add_argument("--server-pid", type=int, help="sample this process's RSS instead of our own (HTTP mode)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--fail-on-regression", type=float, help="exit 1 if any compared figure is this many percent worse")
+    return parser.parse_args(argv)
+
+def run(argv=None):
+    args = parse_args(argv)
+    results, wall, sampler = asyncio.run(main(args))
+    summary = summarize(args, results, wall, sampler)
+    print_summary(summary)
+    if args.output:
+        save(summary, args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            rows = compare(json.load(f), summary)
+        print_comparison(rows)
+        if args.fail_on_regression is not None and any(worse > args.fail_on_regression for *_, worse in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    run()
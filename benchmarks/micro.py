@@ -0,0 +1,93 @@
+"""CPU micro-benchmarks for the pipeline building blocks: resize_image, tts and stt.
+
+    python -m benchmarks.micro --app stand_alone --repeat 10 --output micro.json
+
+With STT_CASCADE_MODEL set, stt runs once per quality (auto, fast, accurate).
+tts runs on TTS_ENGINE; run once per engine to compare them.
+
+Each case runs `--warmup` untimed iterations first, so model loading and first-call costs are excluded.
+Results support `--compare` like benchmarks.load.
+"""
+from benchmarks import fixtures
+from benchmarks.app import load_app, APPS, speech_synthesizer
+from benchmarks.report import percentiles, environment, save
+import argparse
+import io
+import json
+import time
+
+TTS_TEXTS = {
+    "sentence": "There is a red mug on the desk.",
+    "paragraph": (
+        "The image shows a red coffee mug on a wooden desk next to an open laptop. "
+        "A small potted plant sits to the right of the mug. "
+        "The room is well lit by a window in the background."
+    ),
+}
+
+def measure(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return percentiles(timings)
+
+def cases(only):
+    from utils.core import resize_image
+    from utils.text_2_speech import tts_pcm, phrase_cache
+    from utils.speech_recognition import stt_file, STT_CASCADE_MODEL, QUALITIES
+
+    if "resize_image" in only:
+        for size in fixtures.IMAGE_SIZES:
+            image = fixtures.image(size)
+            yield f"resize_image/{size}", lambda image=image: resize_image(image)
+    if "tts" in only:
+        for name, text in TTS_TEXTS.items():
+            def synthesize(text=text):
+                # The phrase cache would turn every repeat into a lookup
+                phrase_cache.clear()
+                tts_pcm(text)
+            yield f"tts/{name}", synthesize
+    if "stt" in only:
+        synthesize = speech_synthesizer()
+        # With a cascade model configured, each quality is measured separately
+        qualities = QUALITIES if STT_CASCADE_MODEL else (None,)
+        for length in fixtures.AUDIO_SECONDS:
+            audio = fixtures.audio(length, synthesize)
+            for quality in qualities:
+                name = f"stt/{length}/{quality}" if quality else f"stt/{length}"
+                yield name, lambda audio=audio, quality=quality: stt_file(io.BytesIO(audio), quality)
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=APPS, default="stand_alone")
+    parser.add_argument("--only", nargs="+", choices=("resize_image", "tts", "stt"), default=("resize_image", "tts", "stt"))
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--output", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    load_app(args.app)
+    from utils.text_2_speech import engine
+    results = {"meta": {"app": args.app, "repeat": args.repeat, "warmup": args.warmup, "tts_engine": engine.describe(), **environment()}, "cases": {}}
+    print(f"{'case':<24}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, fn in cases(args.only):
+        p = results["cases"][name] = measure(fn, args.repeat, args.warmup)
+        print(f"{name:<24}{p['p50'] * 1000:>10.1f}{p['p95'] * 1000:>10.1f}{p['p99'] * 1000:>10.1f}")
+    if args.output:
+        save(results, args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["cases"]
+        print(f"{'case':<24}{'baseline p50':>14}{'current p50':>14}{'change':>10}")
+        for name, p in results["cases"].items():
+            if name in baseline:
+                old = baseline[name]["p50"]
+                print(f"{name:<24}{old * 1000:>14.1f}{p['p50'] * 1000:>14.1f}{(p['p50'] - old) / old * 100:>+9.1f}%")
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import time
+import numpy as np
+
+def percentiles(values):
+    if not values:
+        return None
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        "count": int(len(values)),
+        "mean": float(values.mean()),
+        "p50": float(np.percentile(values, 50)),
+        "p95": float(np.percentile(values, 95)),
+        "p99": float(np.percentile(values, 99)),
+        "max": float(values.max()),
+    }
+
+def parse_server_timing(header):
+    # "stage;dur=12.3, other;dur=4.5" -> {"stage": 0.0123, "other": 0.0045}
+    stages = {}
+    for item in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, params = item.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                stages[name] = float(value) / 1000
+    return stages
+
+def rss_bytes(pid=None):
+    # Current resident set size from /proc; falls back to this process's peak where /proc is missing
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        if pid is None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if platform.system() == "Darwin" else peak * 1024
+        return None
+
+class RssSampler:
+    """Samples RSS of `pid` (default: this process) in the background to catch the peak."""
+
+    def __init__(self, pid=None, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+
+    async def run(self, stop):
+        while not stop.is_set():
+            rss = rss_bytes(self.pid)
+            if rss is not None:
+                self.samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self):
+        if not self.samples:
+            return None
+        mb = [s / 1024 / 1024 for s in self.samples]
+        return {"start_mb": mb[0], "peak_mb": max(mb), "end_mb": mb[-1]}
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def save(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {path}")
+
+# Metrics compared against a baseline: (path into the results, True if higher is better)
+COMPARED = [
+    (("latency", "p50"), False),
+    (("latency", "p95"), False),
+    (("latency", "p99"), False),
+    (("ttfb", "p50"), False),
+    (("ttfb", "p95"), False),
+    (("throughput_rps",), True),
+    (("rss", "peak_mb"), False),
+]
+
+def _lookup(results, path):
+    for key in path:
+        if not isinstance(results, dict) or results.get(key) is None:
+            return None
+        results = results[key]
+    return results
+
+def compare(baseline, current):
+    """Rows of (metric, baseline, current, change %, regressed %) where regressed is positive when worse."""
+    rows = []
+    for path, higher_is_better in COMPARED:
+        old, new = _lookup(baseline, path), _lookup(current, path)
+        if not old or new is None:
+            continue
+        change = (new - old) / old * 100
+        rows.append((".".join(path), old, new, change, -change if higher_is_better else change))
+    return rows
+
+def print_comparison(rows):
+    print(f"{'metric':<18}{'baseline':>12}{'current':>12}{'change':>10}")
+    for metric, old, new, change, _ in rows:
+        print(f"{metric:<18}{old:>12.4f}{new:>12.4f}{change:>+9.1f}%")
@@ -0,0 +1,23 @@
+"""Runs an app under uvicorn with the fake Gemini client and in-memory user store, for HTTP benchmarks.
+
+    python -m benchmarks.serve --app backend --port 8282 --llm-latency 0.5
+"""
+from benchmarks.app import load_app, APPS
+import argparse
+import os
+import uvicorn
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=APPS, default="stand_alone")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8282)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-first-token", type=float, default=0.2)
+    args = parser.parse_args(argv)
+    app = load_app(args.app, args.llm_latency, args.llm_first_token).app
+    print(f"Benchmark server pid {os.getpid()} (pass to benchmarks.load --server-pid)")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    run()
@@ -1,17 +1,32 @@
-from fastapi import FastAPI,BackgroundTasks
+from fastapi import FastAPI,BackgroundTasks,Request,WebSocket
+from fastapi.websockets import WebSocketDisconnect, WebSocketState
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse, Response
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel
-from utils.speech_recognition import stt
-from utils.text_2_speech import tts
-from utils.core import google_client
-from typing import Optional
-import os,shutil
+from utils.audio import wav_header, pcm_to_wav, DEFAULT_VOICE, STT_SAMPLE_RATE
+from utils.core import prepare_image, prepare_frame, load_frame, distinct_frames, record_burst, get_image_stats, generate_answer_stream, frames_request, generate_request_async, generate_request_stream, is_error_answer, is_complete_answer, gemini, GEMINI_MODEL, BURST_MAX_FRAMES
+from utils.response_cache import response_cache
+from utils.sessions import session_store, SESSION_GEMINI_FILES
+from utils.pipeline import pipelined_tts, get_pipeline_stats
+from utils.streaming_stt import StreamingTranscriber, make_decoder, transcribe_websocket
+from utils.artifacts import artifact_store
+from utils.uploads import read_upload, form_flag, UploadTooLargeError
+from utils.executor import QueueFullError, stt_executor, tts_executor, image_executor, executor_stats
+from utils.lifecycle import ROLE, start_loading, readiness, ModelUnavailableError
+from utils.jobs import job_client, speech_backend
+from utils.metrics import MetricsMiddleware, render_metrics, request_decoded, CONTENT_TYPE
+from typing import List, Optional
+import asyncio
+import functools
 
 
 app = FastAPI()
 
+# Local models, or STT/TTS workers behind the job broker when ROLE=gateway
+speech = speech_backend()
+
 # CORS middleware setup remains the same
 app.add_middleware(
     CORSMiddleware,
@@ -19,61 +34,385 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(MetricsMiddleware)
 
 class QueryRequest(BaseModel):
     user_input: str
     img_base64: str
+    stream: bool = False
+
+class BurstRequest(BaseModel):
+    user_input: str
+    frames: List[str]
+    stream: bool = False
+
+class SessionRequest(BaseModel):
+    img_base64: str
+
+class SessionQueryRequest(BaseModel):
+    user_input: str
+    stream: bool = False
 
 class TranscribeRequest(BaseModel):
     audio: str
     format: str = "wav"
+    # auto, fast or accurate; see STT_CASCADE_MODEL
+    quality: Optional[str] = None
 
     
-def delete_audio_files():
-     # Your cleanup function remains unchanged
-     audio_folder = "./audio"
-     for filename in os.listdir(audio_folder):
-         file_path = os.path.join(audio_folder, filename)
-         try:
-             if os.path.isfile(file_path) or os.path.islink(file_path):
-                 os.unlink(file_path)
-             elif os.path.isdir(file_path):
-                 shutil.rmtree(file_path)
-         except Exception as e:
-             print(f'Failed to delete {file_path}. Reason: {e}')
+async def stream_audio(audio):
+    # `audio` is an async generator of PCM chunks.
+    # Pull the first segment before committing to a 200 so synthesis failures still surface as errors
+    try:
+        first = await audio.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except (QueueFullError, ModelUnavailableError):
+        raise
+    except Exception as e:
+        print(f"Error in stream_audio: {str(e)}")
+        first = None
+    if first is None:
+        await audio.aclose()
+        return JSONResponse(status_code=500, content={"message": "Failed to generate audio"})
+
+    async def body():
+        try:
+            yield wav_header()
+            yield first
+            async for chunk in audio:
+                yield chunk
+        finally:
+            await audio.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type='audio/wav',
+        headers={'Content-Disposition': 'attachment; filename="response.wav"'}
+    )
+
+@app.exception_handler(QueueFullError)
+async def queue_full(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=429,
+        content={"message": f"Server busy ({exc.name}), retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(ModelUnavailableError)
+async def model_unavailable(request: Request, exc: ModelUnavailableError):
+    headers = {"Retry-After": str(exc.retry_after)} if exc.retry_after else None
+    return JSONResponse(status_code=503, content={"message": str(exc)}, headers=headers)
+
+@app.exception_handler(UploadTooLargeError)
+async def upload_too_large(request: Request, exc: UploadTooLargeError):
+    return JSONResponse(status_code=413, content={"message": str(exc)})
+
+@app.on_event("startup")
+def load_models():
+    artifact_store.start_janitor()
+    # Loads and warms the models enabled by MODELS, blocking or in the background per MODEL_LOADING
+    start_loading()
+    if ROLE == "gateway":
+        job_client.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    artifact_store.stop_janitor()
 
 @app.get("/")
 def health():
+    # Liveness: the process is up, whether or not the models have loaded
     return {"status": "ok"}
 
+@app.get("/ready")
+def ready():
+    # Readiness: models loaded and warmed up, so traffic can be routed here
+    status = readiness()
+    if ROLE == "gateway":
+        status['jobs'] = job_client.status()
+        status['ready'] = status['ready'] and job_client.ready()
+    return JSONResponse(status_code=200 if status['ready'] else 503, content=status)
 
+@app.get("/metrics")
+def metrics():
+    # Prometheus text format: per-stage and per-route latency histograms plus every /stats value as a gauge
+    return Response(content=render_metrics(stats()), media_type=CONTENT_TYPE)
 
-@app.post('/transcribe')
-async def transcribe(request: TranscribeRequest,):
-    print("Received transcription request")
-    if not request.audio:
-        return JSONResponse(status_code=400, content={"message": "Audio is required"})
-    data = stt(request.audio, request.format)
+@app.get("/stats")
+def stats():
+    return {**speech.stats(), "executors": executor_stats(), "pipeline": get_pipeline_stats(), "response_cache": response_cache.stats(), "images": get_image_stats(), "gemini": gemini.stats(), "sessions": session_store.stats(), "artifacts": artifact_store.stats(), "jobs": job_client.status() if ROLE == "gateway" else None}
+
+
+
+def transcription_response(data):
     if data['flag']:
         return JSONResponse(status_code=200, content={"text": data['text']})
     else:
-        return JSONResponse(status_code=500, content={"message": data['text']})
+        return JSONResponse(status_code=data.get('status', 500), content={"message": data['text']})
 
+def prepare_query_image(image, user_input):
+    resized_image, mime_type = prepare_image(image)
+    cache_key = response_cache.key_for(resized_image, user_input, GEMINI_MODEL, DEFAULT_VOICE)
+    return resized_image, mime_type, cache_key
 
-@app.post('/query')
-def resp(request: QueryRequest,background_tasks:BackgroundTasks):
-    if not request.user_input:
+async def collect_text(text_chunks, parts):
+    async for chunk in text_chunks:
+        parts.append(chunk)
+        yield chunk
+
+async def cache_stream(audio, text_parts, cache_key, on_answer=None):
+    # Passes PCM through and caches the full response once the stream has completed
+    pcm = []
+    try:
+        async for chunk in audio:
+            pcm.append(chunk)
+            yield chunk
+    finally:
+        await audio.aclose()
+    # Nothing is cached or recorded when the stream failed, even after Gemini had sent part of the answer
+    if is_complete_answer(text_parts):
+        text = ''.join(text_parts)
+        if on_answer is not None:
+            on_answer(text)
+        if cache_key is not None:
+            await run_in_threadpool(response_cache.put, cache_key, text, pcm_to_wav(b''.join(pcm)))
+
+def cache_artifact(cache_key, text, artifact_id):
+    response_cache.put(cache_key, text, artifact_store.read(artifact_id))
+
+def artifact_response(artifact_id, background_tasks):
+    # The reference keeps the janitor away from the artifact until the response has been sent
+    artifact_store.acquire(artifact_id)
+    background_tasks.add_task(artifact_store.release, artifact_id)
+    path = artifact_store.path(artifact_id)
+    if path is not None:
+        return FileResponse(path, media_type='audio/wav', filename=f'response.wav')
+    return audio_response(artifact_store.read(artifact_id))
+
+def audio_response(wav: bytes):
+    return Response(content=wav, media_type='audio/wav', headers={'Content-Disposition': 'attachment; filename="response.wav"'})
+
+async def answer_query(image, user_input, stream, background_tasks):
+    # `image` is the base64 string from the JSON form or the raw bytes from an upload
+    if not user_input:
         return JSONResponse(status_code=400, content={"message": "Query is required"})
-    if not request.img_base64:
+    if not image:
         return JSONResponse(status_code=400, content={"message": "Image is required"})
+    try:
+        resized_image, mime_type, cache_key = await image_executor.run(prepare_query_image, image, user_input)
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"Error preparing image: {str(e)}")
+        return JSONResponse(status_code=400, content={"message": "Invalid image"})
+    return await answer_images([(resized_image, mime_type)], user_input, cache_key, stream, background_tasks)
+
+async def answer_burst(frames, user_input, stream, background_tasks):
+    # Several frames of one scene, one Gemini call and one spoken answer
+    if not user_input:
+        return JSONResponse(status_code=400, content={"message": "Query is required"})
+    if not frames:
+        return JSONResponse(status_code=400, content={"message": "At least one frame is required"})
+    if len(frames) > BURST_MAX_FRAMES:
+        return JSONResponse(status_code=400, content={"message": f"At most {BURST_MAX_FRAMES} frames are allowed"})
+    try:
+        # Frames are decoded and hashed in parallel, repeats dropped, and only the survivors resized
+        loaded = await asyncio.gather(*(image_executor.run(load_frame, frame) for frame in frames))
+        kept = distinct_frames(loaded)
+        images = await asyncio.gather(*(image_executor.run(prepare_frame, image_data, image_type) for image_data, image_type, _ in kept))
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"Error preparing frames: {str(e)}")
+        return JSONResponse(status_code=400, content={"message": "Invalid image"})
+    record_burst(len(frames), len(images))
+    if len(images) == 1:
+        # A still scene is just a /query, and shares its cache entries
+        cache_key = response_cache.key_for(images[0][0], user_input, GEMINI_MODEL, DEFAULT_VOICE)
+    else:
+        cache_key = response_cache.key_for(b''.join(image_data for image_data, _ in images), user_input, GEMINI_MODEL, DEFAULT_VOICE, near=False)
+    return await answer_images(images, user_input, cache_key, stream, background_tasks)
+
+async def answer_images(images, user_input, cache_key, stream, background_tasks):
+    # `images` is a list of (data, mime_type), already resized
+    return await answer_request(frames_request(images, user_input), cache_key, stream, background_tasks)
+
+async def answer_request(request, cache_key, stream, background_tasks, on_answer=None):
+    # `request` is a prepared Gemini request; `cache_key` None skips the response cache,
+    # `on_answer(text)` is called with every successful answer
+    cached = await run_in_threadpool(response_cache.get, cache_key) if cache_key is not None else None
+    if cached is not None:
+        if on_answer is not None:
+            on_answer(cached['text'])
+        return audio_response(cached['audio'])
+    # Fail before spending a Gemini call when this process can't synthesize the answer
+    speech.check_available("tts")
+
+    if stream:
+        # Sentences are synthesized while Gemini is still generating the rest of the answer
+        text_parts = []
+        text_chunks = collect_text(generate_request_stream(request), text_parts)
+        return await stream_audio(cache_stream(pipelined_tts(text_chunks, tts_executor, synthesize=speech.tts_pcm), text_parts, cache_key, on_answer))
+    text_response = await generate_request_async(request)
+    res = await tts_executor.run(speech.tts, text_response)
+    if res['flag']:
+        if not is_error_answer(text_response):
+            if on_answer is not None:
+                on_answer(text_response)
+            if cache_key is not None:
+                await run_in_threadpool(cache_artifact, cache_key, text_response, res['id'])
+        return artifact_response(res['id'], background_tasks)
     else:
-        text_response = google_client(request.img_base64, request.user_input)
-        res = tts(text_response)
-        if res['flag']:
-            background_tasks.add_task(delete_audio_files)
-            return FileResponse(f'audio/{res["id"]}.wav', media_type='audio/wav', filename=f'response.wav')
-        else:
-            return JSONResponse(status_code=500, content={"message": "Failed to generate audio"})
-        
+        return JSONResponse(status_code=500, content={"message": "Failed to generate audio"})
+
+async def start_session(image, owner, background_tasks):
+    # The photo is decoded and resized once; follow-ups reuse the prepared bytes
+    if not image:
+        return JSONResponse(status_code=400, content={"message": "Image is required"})
+    try:
+        resized_image, mime_type = await image_executor.run(prepare_image, image)
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"Error preparing image: {str(e)}")
+        return JSONResponse(status_code=400, content={"message": "Invalid image"})
+    session = session_store.create(resized_image, mime_type, owner)
+    if SESSION_GEMINI_FILES:
+        background_tasks.add_task(session_store.upload, session)
+    return JSONResponse(status_code=200, content={"session_id": session.id, "expires_in": session_store.ttl})
+
+async def answer_session(session_id, owner, user_input, stream, background_tasks):
+    if not user_input:
+        return JSONResponse(status_code=400, content={"message": "Query is required"})
+    session = session_store.get(session_id, owner)
+    if session is None:
+        return JSONResponse(status_code=404, content={"message": "Session not found or expired"})
+    # The first question about a photo is answered exactly like a /query, and shares its cache entries
+    cache_key = None if session.history else response_cache.key_for(session.image_data, user_input, GEMINI_MODEL, DEFAULT_VOICE)
+    return await answer_request(session.request(user_input), cache_key, stream, background_tasks,
+                                on_answer=functools.partial(session.add_turn, user_input))
+
+async def answer_websocket(websocket: WebSocket, image, user_input):
+    # The streamed /query pipeline for a spoken question: WAV audio as binary messages, then the answer text
+    if not user_input:
+        await websocket.send_json({"type": "error", "message": "No speech detected"})
+        return
+    try:
+        resized_image, mime_type, cache_key = await image_executor.run(prepare_query_image, image, user_input)
+    except QueueFullError:
+        raise
+    except Exception as e:
+        print(f"Error preparing image: {str(e)}")
+        await websocket.send_json({"type": "error", "message": "Invalid image"})
+        return
+
+    cached = await run_in_threadpool(response_cache.get, cache_key)
+    if cached is not None:
+        await websocket.send_bytes(cached['audio'])
+        await websocket.send_json({"type": "answer", "text": cached['text']})
+        return
+    speech.check_available("tts")
+
+    text_parts = []
+    text_chunks = collect_text(generate_answer_stream(resized_image, mime_type, user_input), text_parts)
+    audio = cache_stream(pipelined_tts(text_chunks, tts_executor, synthesize=speech.tts_pcm), text_parts, cache_key)
+    try:
+        await websocket.send_bytes(wav_header())
+        async for chunk in audio:
+            await websocket.send_bytes(chunk)
+    finally:
+        await audio.aclose()
+    await websocket.send_json({"type": "answer", "text": ''.join(text_parts)})
+
+
+@app.post('/transcribe')
+async def transcribe(request: TranscribeRequest,):
+    print("Received transcription request")
+    request_decoded()
+    if not request.audio:
+        return JSONResponse(status_code=400, content={"message": "Audio is required"})
+    data = await stt_executor.run(speech.stt, request.audio, request.format, request.quality)
+    return transcription_response(data)
+
+@app.post('/transcribe/upload')
+async def transcribe_upload(request: Request):
+    # multipart/form-data with an `audio` file part, or the raw audio as application/octet-stream
+    async with read_upload(request, 'audio') as (audio_file, fields):
+        request_decoded()
+        if audio_file is None:
+            return JSONResponse(status_code=400, content={"message": "Audio is required"})
+        data = await stt_executor.run(speech.stt_file, audio_file, fields.get('quality'))
+    return transcription_response(data)
+
+@app.websocket('/transcribe/stream')
+async def transcribe_stream(websocket: WebSocket, format: str = "pcm16", sample_rate: int = STT_SAMPLE_RATE, quality: Optional[str] = None):
+    # Live microphone input: binary audio messages in, partial and final hypotheses out as JSON.
+    # {"type": "end"} finishes the stream; with an img_base64 the transcript is answered like a streamed /query
+    await websocket.accept()
+    try:
+        decoder = make_decoder(format, sample_rate)
+        transcriber = StreamingTranscriber(speech.transcribe_audio, speech.speech_timestamps, quality=quality)
+    except ValueError as e:
+        await websocket.send_json({"type": "error", "message": str(e)})
+        await websocket.close(code=1003)
+        return
+    try:
+        end = await transcribe_websocket(websocket, transcriber, decoder, stt_executor)
+        if end is not None and end.get("img_base64"):
+            try:
+                await answer_websocket(websocket, end["img_base64"], transcriber.text)
+            except (QueueFullError, ModelUnavailableError) as e:
+                await websocket.send_json({"type": "error", "message": str(e), "retry_after": e.retry_after})
+        if websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close()
+    except WebSocketDisconnect:
+        pass
+
+
+@app.post('/query')
+async def resp(request: QueryRequest,background_tasks:BackgroundTasks):
+    request_decoded()
+    return await answer_query(request.img_base64, request.user_input, request.stream, background_tasks)
+
+@app.post('/query/burst')
+async def resp_burst(request: BurstRequest, background_tasks: BackgroundTasks):
+    # Up to BURST_MAX_FRAMES base64 frames in capture order, answered together
+    request_decoded()
+    return await answer_burst(request.frames, request.user_input, request.stream, background_tasks)
+
+@app.post('/session')
+async def create_session(request: SessionRequest, background_tasks: BackgroundTasks):
+    # Upload a photo once, then ask about it by session_id
+    request_decoded()
+    return await start_session(request.img_base64, None, background_tasks)
+
+@app.post('/session/upload')
+async def create_session_upload(request: Request, background_tasks: BackgroundTasks):
+    # multipart/form-data with an `image` file part, or the raw image as application/octet-stream
+    async with read_upload(request, 'image') as (image_file, fields):
+        image = image_file.read() if image_file is not None else None
+        request_decoded()
+    return await start_session(image, None, background_tasks)
+
+@app.post('/session/{session_id}/query')
+async def session_query(session_id: str, request: SessionQueryRequest, background_tasks: BackgroundTasks):
+    request_decoded()
+    return await answer_session(session_id, None, request.user_input, request.stream, background_tasks)
+
+@app.delete('/session/{session_id}')
+async def end_session(session_id: str):
+    if not await run_in_threadpool(session_store.delete, session_id, None):
+        return JSONResponse(status_code=404, content={"message": "Session not found or expired"})
+    return JSONResponse(status_code=200, content={"message": "Session ended"})
 
+@app.post('/query/upload')
+async def resp_upload(request: Request, background_tasks: BackgroundTasks):
+    # multipart/form-data with `user_input`, optional `stream` and an `image` file part,
+    # or the raw image as application/octet-stream with `user_input`/`stream` in the query string
+    async with read_upload(request, 'image') as (image_file, fields):
+        image = image_file.read() if image_file is not None else None
+        request_decoded()
+    return await answer_query(image, fields.get('user_input'), form_flag(fields.get('stream')), background_tasks)
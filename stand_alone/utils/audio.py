@@ -0,0 +1,44 @@
+from dotenv import load_dotenv
+from utils.metrics import timed
+import struct
+import os
+load_dotenv()
+
+# Audio formats and speech request settings shared by the gateway and the speech models;
+# importing this pulls in no model library
+TTS_SAMPLE_RATE = 24000
+STT_SAMPLE_RATE = 16000
+DEFAULT_VOICE = 'af_heart'
+STT_BEAM_SIZE = int(os.getenv("STT_BEAM_SIZE", "5"))
+# Longest clip Whisper transcribes in one window
+CHUNK_SECONDS = 30
+# Per-request `quality`: auto (cascade), fast (small model only) or accurate (STT_MODEL only)
+QUALITIES = ("auto", "fast", "accurate")
+STT_QUALITY = os.getenv("STT_QUALITY", "auto")
+
+class AudioTooLargeError(ValueError):
+    pass
+
+class InvalidQualityError(ValueError):
+    pass
+
+def check_quality(quality):
+    quality = quality or STT_QUALITY
+    if quality not in QUALITIES:
+        raise InvalidQualityError(f"quality must be one of {', '.join(QUALITIES)}")
+    return quality
+
+def wav_header(sample_rate=TTS_SAMPLE_RATE, channels=1, bits_per_sample=16, data_size=0xFFFFFFFF):
+    # Streamed WAV: total length is unknown up front, so the size fields are left at max
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    riff_size = 0xFFFFFFFF if data_size == 0xFFFFFFFF else 36 + data_size
+    return (
+        b'RIFF' + struct.pack('<I', riff_size) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+def pcm_to_wav(pcm: bytes, sample_rate=TTS_SAMPLE_RATE) -> bytes:
+    with timed("wav_encode"):
+        return wav_header(sample_rate, data_size=len(pcm)) + pcm
@@ -3,13 +3,35 @@ from google.genai import types
 from dotenv import load_dotenv
 import os, re
 import base64
-from PIL import Image
+from PIL import Image, ImageOps
+import threading
+import time
 import io
+from utils.response_cache import dhash
+from utils.gemini_client import ResilientClient, GeminiUnavailableError, GEMINI_FALLBACK_MODELS
+from utils.metrics import timed, observe_stage
+from utils.answers import ERROR_MESSAGE, UNAVAILABLE_MESSAGE, EMPTY_ANSWER_MESSAGE, is_error_answer, is_complete_answer
 load_dotenv()
 
 api_key = os.getenv("GEMINI_API_KEY")
 sys_instruct="you are an AI assistant whose main task is to help people with notifying what is in the image based on the user query. give the output in single paragraph."
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash-exp")
 g_client = genai.Client(api_key=api_key)
+# g_client is looked up on every call, so it can be swapped out (benchmarks use a fake)
+gemini = ResilientClient(lambda: g_client, [GEMINI_MODEL, *GEMINI_FALLBACK_MODELS])
+
+IMAGE_MAX_SIZE = int(os.getenv("IMAGE_MAX_SIZE", "512"))
+IMAGE_TARGET_SIZE = (IMAGE_MAX_SIZE, IMAGE_MAX_SIZE)
+# JPEG or WEBP
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+BURST_MAX_FRAMES = int(os.getenv("BURST_MAX_FRAMES", "8"))
+# Hamming distance on a 64-bit dHash within which a frame counts as a repeat of the last frame kept
+BURST_DUPLICATE_DISTANCE = int(os.getenv("BURST_DUPLICATE_DISTANCE", "6"))
+BURST_INSTRUCTION = "The images are consecutive camera frames taken a moment apart, oldest first. Answer about the scene they show together."
+
+_image_stats_lock = threading.Lock()
+image_stats = {"count": 0, "resized_count": 0, "burst_count": 0, "burst_frames": 0, "burst_duplicates": 0}
 
 def get_image_type(base64_string):
     match = re.match(r'data:image/(?P<type>\w+);base64,', base64_string)
@@ -17,7 +39,34 @@ def get_image_type(base64_string):
         return match.group('type')
     return None
 
-def resize_image(image_data, target_size=(512, 512)):
+def _record_image_stats(stats):
+    with _image_stats_lock:
+        image_stats["count"] += 1
+        for key in ("input_bytes", "output_bytes", "decode_seconds", "resize_seconds", "encode_seconds", "total_seconds"):
+            image_stats[key] = image_stats.get(key, 0) + stats.get(key, 0)
+        if stats.get("resized"):
+            image_stats["resized_count"] += 1
+
+def record_burst(received, kept):
+    with _image_stats_lock:
+        image_stats["burst_count"] += 1
+        image_stats["burst_frames"] += received
+        image_stats["burst_duplicates"] += received - kept
+
+def get_image_stats():
+    with _image_stats_lock:
+        stats = dict(image_stats)
+    if stats["count"]:
+        stats["avg_seconds"] = stats.get("total_seconds", 0.0) / stats["count"]
+        stats["avg_input_bytes"] = stats.get("input_bytes", 0) / stats["count"]
+        stats["avg_output_bytes"] = stats.get("output_bytes", 0) / stats["count"]
+    return stats
+
+def resize_image(image_data, target_size=IMAGE_TARGET_SIZE, stats=None):
+    # Fills `stats` (if given) with per-stage timings and byte sizes
+    stats = {} if stats is None else stats
+    start = time.perf_counter()
+    stats["input_bytes"] = len(image_data)
     try:
         # Open the image with PIL
         img = Image.open(io.BytesIO(image_data))
@@ -25,63 +74,162 @@ def resize_image(image_data, target_size=(512, 512)):
         # Get original image format
         img_format = img.format or "JPEG"
         
-        # Calculate new dimensions (maintaining aspect ratio)
-        original_width, original_height = img.size
-        ratio = min(target_size[0] / original_width, target_size[1] / original_height)
-        new_width = int(original_width * ratio)
-        new_height = int(original_height * ratio)
+        # Large JPEG camera frames are decoded at a reduced scale (1/2 .. 1/8) instead of full size
+        if img_format == "JPEG":
+            longest = max(target_size)
+            img.draft("RGB", (longest, longest))
+        
+        # Apply EXIF orientation so rotated phone photos reach the model upright
+        rotated = img.getexif().get(0x0112, 1) not in (None, 1)
+        if rotated:
+            img = ImageOps.exif_transpose(img)
+        img.load()
+        stats["decode_seconds"] = time.perf_counter() - start
+        
+        # Only shrink, never upscale (maintaining aspect ratio)
+        resize_start = time.perf_counter()
+        stats["resized"] = img.width > target_size[0] or img.height > target_size[1]
+        if stats["resized"]:
+            img.thumbnail(target_size, Image.Resampling.LANCZOS)
+        stats["resize_seconds"] = time.perf_counter() - resize_start
+        stats["width"], stats["height"] = img.size
         
-        # Resize the image
-        img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        # Small images already in the output format are passed through untouched
+        if not stats["resized"] and not rotated and img_format == IMAGE_OUTPUT_FORMAT:
+            stats["output_bytes"] = len(image_data)
+            return image_data, f"image/{img_format.lower()}"
         
-        # Convert back to bytes
+        # Re-encode to the configured format and quality
+        encode_start = time.perf_counter()
+        if IMAGE_OUTPUT_FORMAT == "JPEG" and img.mode != "RGB":
+            img = img.convert("RGB")
         output_buffer = io.BytesIO()
-        img.save(output_buffer, format=img_format)
+        img.save(output_buffer, format=IMAGE_OUTPUT_FORMAT, quality=IMAGE_QUALITY)
         resized_data = output_buffer.getvalue()
+        stats["encode_seconds"] = time.perf_counter() - encode_start
+        stats["output_bytes"] = len(resized_data)
         
         # Determine mime type
-        mime_type = f"image/{img_format.lower()}"
+        mime_type = f"image/{IMAGE_OUTPUT_FORMAT.lower()}"
         
         return resized_data, mime_type
     except Exception as e:
         print(f"Error resizing image: {str(e)}")
+        stats["output_bytes"] = len(image_data)
         # Return original data if resize fails
         return image_data, None
+    finally:
+        stats["total_seconds"] = time.perf_counter() - start
+        _record_image_stats(stats)
+        observe_stage("resize_image", stats["total_seconds"])
+
+def decode_image_base64(img_base64: str):
+    # Get original image type (read before the data URL prefix is stripped)
+    image_type = get_image_type(img_base64) or "jpeg"
+
+    # Check if the base64 string includes the data URL prefix
+    if ',' in img_base64:
+        # Split off the data URL prefix if present
+        img_base64 = img_base64.split(',', 1)[1]
+    
+    # Decode the base64 image
+    with timed("base64_decode"):
+        return base64.b64decode(img_base64), image_type
+
+def prepare_image(image, target_size=IMAGE_TARGET_SIZE):
+    # `image` is either a base64 string (optionally a data URL) or raw uploaded bytes
+    if isinstance(image, str):
+        image_data, image_type = decode_image_base64(image)
+    else:
+        image_data, image_type = bytes(image), "jpeg"
+    
+    return prepare_frame(image_data, image_type, target_size)
+
+def prepare_frame(image_data: bytes, image_type: str, target_size=IMAGE_TARGET_SIZE):
+    # Resize the image
+    resized_image, mime_type = resize_image(image_data, target_size)
+    
+    # Use determined mime type or fall back to original
+    if not mime_type:
+        mime_type = f"image/{image_type}"
+    return resized_image, mime_type
+
+def load_frame(image):
+    # One frame of a burst, decoded and hashed (the dHash is the cheap diff used to drop repeats)
+    if isinstance(image, str):
+        image_data, image_type = decode_image_base64(image)
+    else:
+        image_data, image_type = bytes(image), "jpeg"
+    return image_data, image_type, dhash(image_data)
+
+def distinct_frames(frames):
+    # `frames` are load_frame results in capture order; a frame is kept only if it differs from the last one kept
+    kept = []
+    for frame in frames:
+        if kept and bin(frame[2] ^ kept[-1][2]).count("1") <= BURST_DUPLICATE_DISTANCE:
+            continue
+        kept.append(frame)
+    return kept
+
+def _request(contents):
+    return dict(
+        config=types.GenerateContentConfig(
+            system_instruction=sys_instruct
+        ),
+        contents=contents
+    )
 
-def google_client(img_base64: str, query: str, target_size=(512, 512)):
+def frames_request(images, query: str):
+    # `images` is a list of (data, mime_type); several go out as the frames of one scene in a single call
+    contents = [query] if len(images) == 1 else [BURST_INSTRUCTION, query]
+    contents += [types.Part.from_bytes(data=image_data, mime_type=mime_type) for image_data, mime_type in images]
+    return _request(contents)
+
+def conversation_request(image_part: types.Part, history, query: str):
+    # Earlier (question, answer) turns about one image; the image goes with the first question only
+    contents = []
+    for question, answer in [*history, (query, None)]:
+        parts = [types.Part.from_text(text=question)]
+        if not contents:
+            parts.insert(0, image_part)
+        contents.append(types.Content(role="user", parts=parts))
+        if answer is not None:
+            contents.append(types.Content(role="model", parts=[types.Part.from_text(text=answer)]))
+    return _request(contents)
+
+def _error_message(e: Exception) -> str:
+    # The exception is logged by the caller; the spoken answer stays fixed so its audio is cached
+    if isinstance(e, GeminiUnavailableError):
+        return UNAVAILABLE_MESSAGE
+    return ERROR_MESSAGE
+
+async def generate_request_async(request):
+    # `request` from frames_request or conversation_request
     try:
-        # Check if the base64 string includes the data URL prefix
-        if ',' in img_base64:
-            # Split off the data URL prefix if present
-            img_base64 = img_base64.split(',', 1)[1]
-        
-        # Decode the base64 image
-        image_data = base64.b64decode(img_base64)
-        
-        # Get original image type
-        image_type = get_image_type(img_base64) or "jpeg"
-        
-        # Resize the image
-        resized_image, mime_type = resize_image(image_data, target_size)
-        
-        # Use determined mime type or fall back to original
-        if not mime_type:
-            mime_type = f"image/{image_type}"
-        
-        # Call Gemini API with resized image
-        response = g_client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            config=types.GenerateContentConfig(
-                system_instruction=sys_instruct
-            ),
-            contents=[
-                query,
-                types.Part.from_bytes(data=resized_image, mime_type=mime_type)
-            ]
-        )
-        
-        return response.text
+        with timed("gemini"):
+            response = await gemini.generate(request)
+        return response.text or EMPTY_ANSWER_MESSAGE
     except Exception as e:
-        print(f"Error in google_client: {str(e)}")
-        return f"Sorry, I couldn't process that image. Error: {str(e)}"
+        print(f"Error in generate_request_async: {str(e)}")
+        return _error_message(e)
+
+def generate_answer_stream(image_data: bytes, mime_type: str, query: str):
+    # Yields the answer text piece by piece as Gemini generates it
+    return generate_frames_answer_stream([(image_data, mime_type)], query)
 
+def generate_frames_answer_stream(images, query: str):
+    return generate_request_stream(frames_request(images, query))
+
+async def generate_request_stream(request):
+    # Text pieces as Gemini generates them; a failure or an empty answer yields a FallbackAnswer
+    produced = False
+    try:
+        async for chunk in gemini.stream(request):
+            if chunk.text:
+                produced = True
+                yield chunk.text
+        if not produced:
+            yield EMPTY_ANSWER_MESSAGE
+    except Exception as e:
+        print(f"Error in generate_request_stream: {str(e)}")
+        yield _error_message(e)
@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from utils.metrics import observe_stage
+import asyncio
+import contextvars
+import functools
+import math
+import os
+import threading
+import time
+load_dotenv()
+
+class QueueFullError(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} queue is full")
+        self.name = name
+        self.retry_after = retry_after
+
+class BoundedExecutor:
+    """Thread pool with an admission limit: at most `workers` running plus `max_queue` waiting."""
+
+    def __init__(self, name, workers, max_queue):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self._rejected = 0
+        self._avg_seconds = 1.0
+
+    def try_admit(self):
+        with self._lock:
+            if self._pending >= self.workers + self.max_queue:
+                self._rejected += 1
+                raise QueueFullError(self.name, self.retry_after())
+            self._pending += 1
+
+    def release(self):
+        with self._lock:
+            self._pending -= 1
+
+    def retry_after(self):
+        # Rough time for the current backlog to drain, from the moving average of job duration
+        backlog = max(1, self._pending - self.workers + 1)
+        return max(1, math.ceil(backlog * self._avg_seconds / self.workers))
+
+    def _timed(self, submitted, fn, *args, **kwargs):
+        with self._lock:
+            self._running += 1
+        start = time.perf_counter()
+        observe_stage(f"{self.name}_queue_wait", start - submitted)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._running -= 1
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed
+
+    async def call(self, fn, *args, **kwargs):
+        # Runs on the pool without admission control; the caller must already hold a slot
+        # The caller's context is carried over so stage timings land on the right request
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._pool, functools.partial(context.run, self._timed, time.perf_counter(), fn, *args, **kwargs))
+
+    async def run(self, fn, *args, **kwargs):
+        self.try_admit()
+        try:
+            return await self.call(fn, *args, **kwargs)
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": max(0, self._pending - self._running),
+                "rejected": self._rejected,
+                "avg_seconds": self._avg_seconds,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+# With micro-batching, workers mostly wait on the batcher, so allow a full batch in flight by default
+stt_executor = BoundedExecutor("stt", int(os.getenv("STT_WORKERS", os.getenv("STT_BATCH_SIZE", "1"))), int(os.getenv("STT_QUEUE_SIZE", "8")))
+tts_executor = BoundedExecutor("tts", int(os.getenv("TTS_WORKERS", os.getenv("TTS_POOL_SIZE", "2"))), int(os.getenv("TTS_QUEUE_SIZE", "16")))
+image_executor = BoundedExecutor("image", int(os.getenv("IMAGE_WORKERS", "2")), int(os.getenv("IMAGE_QUEUE_SIZE", "32")))
+
+def executor_stats():
+    return {e.name: e.stats() for e in (stt_executor, tts_executor, image_executor)}
@@ -0,0 +1,271 @@
+from google.genai import errors
+from collections import deque
+from dotenv import load_dotenv
+from utils.metrics import gemini_seconds
+import asyncio
+import random
+import threading
+import time
+import httpx
+import os
+load_dotenv()
+
+# Tried in order after GEMINI_MODEL once its retries are used up or its circuit is open
+GEMINI_FALLBACK_MODELS = [m.strip() for m in os.getenv("GEMINI_FALLBACK_MODELS", "").split(",") if m.strip()]
+# Per attempt, and for the whole call including retries and fallbacks
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "15"))
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "30"))
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "2"))
+GEMINI_RETRY_BACKOFF = float(os.getenv("GEMINI_RETRY_BACKOFF", "0.25"))
+# Hedging sends a second identical request when the first is slower than the model's recent p95
+GEMINI_HEDGE = os.getenv("GEMINI_HEDGE", "false").lower() in ("1", "true", "yes")
+GEMINI_HEDGE_QUANTILE = float(os.getenv("GEMINI_HEDGE_QUANTILE", "0.95"))
+GEMINI_HEDGE_MIN_DELAY = float(os.getenv("GEMINI_HEDGE_MIN_DELAY", "0.5"))
+GEMINI_BREAKER_FAILURES = int(os.getenv("GEMINI_BREAKER_FAILURES", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+# A retired, renamed or not-enabled model; the next model may well work
+MODEL_ERROR_STATUS = {400, 403, 404}
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 20
+
+class GeminiUnavailableError(Exception):
+    pass
+
+def is_retryable(e: Exception) -> bool:
+    # Upstream overload, stalls and dropped connections; bad requests fail the same way every time
+    if isinstance(e, errors.APIError):
+        return e.code in RETRYABLE_STATUS
+    return isinstance(e, (TimeoutError, asyncio.TimeoutError, httpx.TransportError, ConnectionError))
+
+def is_model_error(e: Exception) -> bool:
+    # 404 and 403 are about the model or the key's access to it; a 400 only when it names the model
+    if not isinstance(e, errors.APIError) or e.code not in MODEL_ERROR_STATUS:
+        return False
+    return e.code != 400 or "model" in str(e).lower()
+
+class CircuitBreaker:
+    """Opens after `failures` consecutive retryable failures and then rejects calls for `reset` seconds.
+
+    After that it is half-open: calls go through again, and the first failure opens it straight back.
+    """
+
+    def __init__(self, failures=GEMINI_BREAKER_FAILURES, reset=GEMINI_BREAKER_RESET):
+        self.failures = failures
+        self.reset = reset
+        self.state = "closed"
+        self.opens = 0
+        self._consecutive = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset:
+                self.state = "half_open"
+            return self.state != "open"
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self._consecutive = 0
+
+    def failure(self):
+        with self._lock:
+            self._consecutive += 1
+            if self.state == "half_open" or (self.state == "closed" and self._consecutive >= self.failures):
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self.opens += 1
+
+class ModelState:
+    """Breaker, recent latencies and counters for one model."""
+
+    def __init__(self, model):
+        self.model = model
+        self.breaker = CircuitBreaker()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "ok": 0, "errors": 0, "timeouts": 0, "short_circuited": 0, "hedged": 0, "hedge_wins": 0}
+
+    def count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def observe(self, seconds, outcome):
+        gemini_seconds.observe(seconds, self.model, outcome)
+        self.count({"ok": "ok", "timeout": "timeouts"}.get(outcome, "errors"))
+        if outcome == "ok":
+            with self._lock:
+                self._latencies.append(seconds)
+
+    def quantile(self, q):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+    def hedge_delay(self):
+        # No hedging until there are enough samples for the quantile to mean something
+        with self._lock:
+            samples = len(self._latencies)
+        if not GEMINI_HEDGE or samples < HEDGE_MIN_SAMPLES:
+            return None
+        return max(GEMINI_HEDGE_MIN_DELAY, self.quantile(GEMINI_HEDGE_QUANTILE))
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self.counts)
+        return {**counts, "circuit": self.breaker.state, "circuit_open": self.breaker.state == "open",
+                "circuit_opens": self.breaker.opens, "p50_seconds": self.quantile(0.5), "p95_seconds": self.quantile(0.95)}
+
+class ResilientClient:
+    """generate_content with deadlines, jittered retries, hedging, a circuit breaker per model and fallback models.
+
+    `client` is called for the genai client on every request, so the module-level client can be replaced
+    (benchmarks and tests swap in a fake). Requests are generate_content keyword arguments without `model`.
+    """
+
+    def __init__(self, client, models):
+        self._client = client
+        self.models = list(dict.fromkeys(models))
+        self._states = {model: ModelState(model) for model in self.models}
+
+    def _schedule(self, deadline, skip):
+        # (model, state, timeout, backoff) per attempt: retries on one model, then the next model.
+        # Models added to `skip` by the caller get no further attempts
+        end = time.monotonic() + deadline
+        for model in self.models:
+            state = self._states[model]
+            for attempt in range(GEMINI_RETRIES + 1):
+                if model in skip:
+                    break
+                if not state.breaker.allow():
+                    state.count("short_circuited")
+                    break
+                # Full jitter keeps retries from many requests from arriving in lockstep
+                backoff = random.uniform(0, GEMINI_RETRY_BACKOFF * 2 ** (attempt - 1)) if attempt else 0.0
+                remaining = end - time.monotonic() - backoff
+                if remaining <= 0:
+                    return
+                yield model, state, min(GEMINI_TIMEOUT, remaining), backoff
+
+    def _failed(self, model, state, error, skip):
+        if is_retryable(error):
+            state.breaker.failure()
+            return error
+        # Not the model's health, so the breaker is left alone; the next model gets its turn
+        if is_model_error(error):
+            print(f"Error in Gemini model {model}: {str(error)}")
+            skip.add(model)
+            return error
+        raise error
+
+    def _unavailable(self, error):
+        if error is None:
+            return GeminiUnavailableError("All Gemini models are unavailable (circuit open)")
+        return GeminiUnavailableError(f"Gemini unavailable: {type(error).__name__}: {error}")
+
+    async def generate(self, request, deadline=GEMINI_DEADLINE):
+        error, skip = None, set()
+        for model, state, timeout, backoff in self._schedule(deadline, skip):
+            if backoff:
+                await asyncio.sleep(backoff)
+            try:
+                return await self._attempt(model, state, request, timeout)
+            except Exception as e:
+                error = self._failed(model, state, e, skip)
+        raise self._unavailable(error) from error
+
+    async def _call(self, model, state, request):
+        state.count("calls")
+        start = time.perf_counter()
+        try:
+            response = await self._client().aio.models.generate_content(model=model, **request)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            state.observe(time.perf_counter() - start, "error")
+            raise
+        state.observe(time.perf_counter() - start, "ok")
+        return response
+
+    async def _attempt(self, model, state, request, timeout):
+        start = time.perf_counter()
+        hedge_at = state.hedge_delay()
+        calls = [asyncio.ensure_future(self._call(model, state, request))]
+        pending = set(calls)
+        error = None
+        try:
+            while pending:
+                elapsed = time.perf_counter() - start
+                hedging = hedge_at is not None and len(calls) == 1
+                if hedging and elapsed >= hedge_at:
+                    state.count("hedged")
+                    calls.append(asyncio.ensure_future(self._call(model, state, request)))
+                    pending.add(calls[-1])
+                    hedging = False
+                wait = timeout - elapsed
+                if wait <= 0:
+                    break
+                if hedging:
+                    wait = min(wait, hedge_at - elapsed)
+                done, pending = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        state.breaker.success()
+                        if task is not calls[0]:
+                            state.count("hedge_wins")
+                        return task.result()
+                    error = task.exception()
+                    if not is_retryable(error):
+                        raise error
+        finally:
+            for task in pending:
+                task.cancel()
+        if pending:
+            gemini_seconds.observe(time.perf_counter() - start, model, "timeout")
+            state.count("timeouts")
+            raise asyncio.TimeoutError(f"{model} did not answer within {timeout:.1f}s")
+        raise error
+
+    async def stream(self, request, deadline=GEMINI_DEADLINE):
+        # Retries and fallbacks only happen before the first chunk: after that the answer is already being spoken.
+        # Streams are not hedged; each chunk must arrive within GEMINI_TIMEOUT of the previous one.
+        error, skip = None, set()
+        for model, state, timeout, backoff in self._schedule(deadline, skip):
+            if backoff:
+                await asyncio.sleep(backoff)
+            state.count("calls")
+            start = time.perf_counter()
+            try:
+                chunks, first = await asyncio.wait_for(self._open_stream(model, request), timeout)
+            except Exception as e:
+                timed_out = isinstance(e, asyncio.TimeoutError)
+                state.observe(time.perf_counter() - start, "timeout" if timed_out else "error")
+                error = self._failed(model, state, e, skip)
+                continue
+            state.breaker.success()
+            # Time to first chunk is what the stall-prone tail is made of
+            state.observe(time.perf_counter() - start, "ok")
+            if first is None:
+                return
+            yield first
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), GEMINI_TIMEOUT)
+                except StopAsyncIteration:
+                    return
+                yield chunk
+        raise self._unavailable(error) from error
+
+    async def _open_stream(self, model, request):
+        chunks = (await self._client().aio.models.generate_content_stream(model=model, **request)).__aiter__()
+        try:
+            return chunks, await chunks.__anext__()
+        except StopAsyncIteration:
+            return chunks, None
+
+    def stats(self):
+        return {model: state.stats() for model, state in self._states.items()}
@@ -0,0 +1,294 @@
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.managers import BaseManager
+from types import SimpleNamespace
+from dotenv import load_dotenv
+from uuid import uuid4
+from utils.lifecycle import ROLE, ModelUnavailableError, start_loading, check_available
+from utils.artifacts import artifact_store
+import io
+import os
+import queue
+import threading
+import time
+load_dotenv()
+
+# Split deployment: one broker process holds the job queues, gateways (ROLE=gateway) put speech jobs
+# on them and STT/TTS workers (ROLE=stt-worker / tts-worker) take them off. Each tier scales on its own.
+#   ROLE=broker python -m utils.jobs
+#   ROLE=stt-worker python -m utils.jobs
+#   ROLE=tts-worker python -m utils.jobs
+#   ROLE=gateway uvicorn main:app
+JOB_BROKER_HOST, _, JOB_BROKER_PORT = os.getenv("JOB_BROKER_ADDRESS", "127.0.0.1:50051").rpartition(":")
+JOB_BROKER_ADDRESS = (JOB_BROKER_HOST, int(JOB_BROKER_PORT))
+JOB_BROKER_AUTHKEY = os.getenv("JOB_BROKER_AUTHKEY", "").encode()
+# The broker unpickles every job it receives, so the authkey is all that stands between it and the network
+if ROLE != "all" and not JOB_BROKER_AUTHKEY:
+    raise RuntimeError(f"ROLE={ROLE} requires JOB_BROKER_AUTHKEY")
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "120"))
+WORKER_HEARTBEAT = float(os.getenv("WORKER_HEARTBEAT", "5"))
+KINDS = ("stt", "tts")
+
+class RemoteJobError(Exception):
+    pass
+
+class WorkerRegistry:
+    """Heartbeats from workers, kept by the broker so gateways can tell whether anyone is listening."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seen = {}
+
+    def heartbeat(self, kind, worker_id):
+        with self._lock:
+            self._seen[(kind, worker_id)] = time.time()
+
+    def live(self):
+        cutoff = time.time() - 3 * WORKER_HEARTBEAT
+        with self._lock:
+            live = {kind: 0 for kind in KINDS}
+            for (kind, _), seen in self._seen.items():
+                if seen >= cutoff:
+                    live[kind] = live.get(kind, 0) + 1
+            return live
+
+class BrokerManager(BaseManager):
+    pass
+
+BrokerManager.register("get_queue")
+BrokerManager.register("registry")
+
+def run_broker():
+    queues = {}
+    lock = threading.Lock()
+    registry = WorkerRegistry()
+
+    def get_queue(name):
+        with lock:
+            return queues.setdefault(name, queue.Queue())
+
+    class Server(BaseManager):
+        pass
+    Server.register("get_queue", callable=get_queue)
+    Server.register("registry", callable=lambda: registry)
+    print(f"Job broker listening on {JOB_BROKER_ADDRESS[0]}:{JOB_BROKER_ADDRESS[1]}")
+    Server(address=JOB_BROKER_ADDRESS, authkey=JOB_BROKER_AUTHKEY).get_server().serve_forever()
+
+def connect():
+    manager = BrokerManager(address=JOB_BROKER_ADDRESS, authkey=JOB_BROKER_AUTHKEY)
+    manager.connect()
+    return manager
+
+class JobClient:
+    """Gateway side: submits jobs and routes results from this gateway's reply queue back to the callers.
+
+    `call` blocks the calling thread, so it is meant to run on the stt/tts BoundedExecutors, whose
+    admission limits then bound the number of jobs this gateway has in flight.
+    """
+
+    def __init__(self):
+        self.gateway_id = uuid4().hex
+        self.reply_to = f"results:{self.gateway_id}"
+        self._manager = None
+        self._queues = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.connected = False
+        # Updated from every stt/tts executor thread, under _lock
+        self.completed = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="job-results", daemon=True)
+            self._thread.start()
+
+    def _connect(self):
+        self._manager = connect()
+        self._queues = {name: self._manager.get_queue(name) for name in (*KINDS, self.reply_to)}
+        self.connected = True
+        print("Connected to job broker")
+
+    def _run(self):
+        while True:
+            try:
+                if not self.connected:
+                    self._connect()
+                job_id, ok, value = self._queues[self.reply_to].get(timeout=1)
+            except queue.Empty:
+                continue
+            except Exception as e:
+                if self.connected:
+                    print(f"Job broker connection lost: {str(e)}")
+                self.connected = False
+                time.sleep(2)
+                continue
+            with self._lock:
+                future = self._pending.pop(job_id, None)
+            if future is not None:
+                future.set_result((ok, value))
+
+    def call(self, kind, op, *args, timeout=JOB_TIMEOUT):
+        if not self.connected:
+            raise RemoteJobError("Job broker is not connected")
+        job_id = uuid4().hex
+        future = Future()
+        with self._lock:
+            self._pending[job_id] = future
+        try:
+            # The deadline lets workers drop jobs nobody is waiting for any more
+            self._queues[kind].put({"id": job_id, "reply_to": self.reply_to, "op": op, "args": args, "deadline": time.time() + timeout})
+            ok, value = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise RemoteJobError(f"{kind} job timed out after {timeout:g}s")
+        finally:
+            with self._lock:
+                self._pending.pop(job_id, None)
+        with self._lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+        if ok:
+            return value
+        if value.get("model_unavailable"):
+            raise ModelUnavailableError(*value["model_unavailable"])
+        raise RemoteJobError(value["message"])
+
+    def status(self):
+        with self._lock:
+            status = {"connected": self.connected, "pending": len(self._pending), "completed": self.completed,
+                      "failed": self.failed, "timed_out": self.timed_out}
+        if self.connected:
+            try:
+                status["workers"] = self._manager.registry().live()
+                status["queued"] = {kind: self._queues[kind].qsize() for kind in KINDS}
+            except Exception as e:
+                status["error"] = str(e)
+        return status
+
+    def ready(self):
+        # At least one live worker of each kind behind a connected broker
+        status = self.status()
+        return status["connected"] and all(status.get("workers", {}).get(kind) for kind in KINDS)
+
+job_client = JobClient()
+
+def _remote_stt(base64_audio: str, audio_type: str, quality=None):
+    try:
+        return job_client.call("stt", "stt", base64_audio, audio_type, quality)
+    except RemoteJobError as e:
+        print(f"Error in remote stt: {str(e)}")
+        return {"text": "Failed to process audio", "flag": False, "status": 503}
+
+def _remote_stt_file(audio_file, quality=None):
+    audio_file.seek(0)
+    try:
+        return job_client.call("stt", "stt_bytes", audio_file.read(), quality)
+    except RemoteJobError as e:
+        print(f"Error in remote stt_file: {str(e)}")
+        return {"text": "Failed to process audio", "flag": False, "status": 503}
+
+def _remote_transcribe_audio(audio, beam_size, initial_prompt=None, quality=None) -> str:
+    return job_client.call("stt", "transcribe_audio", audio, beam_size, initial_prompt, quality)
+
+def _remote_speech_timestamps(audio, min_silence_ms):
+    # Streaming sessions buffer audio on the gateway; the VAD ships with faster-whisper, so it runs on the workers
+    return job_client.call("stt", "speech_timestamps", audio, min_silence_ms)
+
+def _remote_tts_pcm(text, voice, speed=1) -> bytes:
+    return job_client.call("tts", "tts_pcm", text, voice, speed)
+
+def _remote_tts(text, voice, speed=1):
+    # The worker returns PCM; the WAV artifact is stored here, where the response is served from
+    try:
+        pcm = _remote_tts_pcm(text, voice, speed)
+    except RemoteJobError as e:
+        print(f"Error in remote tts: {str(e)}")
+        return {'flag':False}
+    if not pcm:
+        return {'flag':False}
+    from utils.audio import pcm_to_wav
+    return {'flag':True,'id':artifact_store.put(pcm_to_wav(pcm))}
+
+def speech_backend():
+    """stt/stt_file/transcribe_audio/speech_timestamps/tts/tts_pcm/check_available/stats for this process: the local models, or the workers behind the broker.
+
+    Kokoro, torch and faster-whisper are only imported for local models, so a gateway runs without them.
+    """
+    if ROLE == "gateway":
+        from utils.audio import DEFAULT_VOICE
+        return SimpleNamespace(
+            stt=_remote_stt, stt_file=_remote_stt_file, transcribe_audio=_remote_transcribe_audio, speech_timestamps=_remote_speech_timestamps,
+            tts=lambda text, voice=DEFAULT_VOICE, speed=1: _remote_tts(text, voice, speed),
+            tts_pcm=lambda text, voice=DEFAULT_VOICE, speed=1: _remote_tts_pcm(text, voice, speed),
+            # Workers report their own model state with each job
+            check_available=lambda name: None,
+            stats=lambda: {"stt": None, "tts": None},
+        )
+    from utils.text_2_speech import tts, tts_pcm, get_tts_stats
+    from utils.speech_recognition import stt, stt_file, transcribe_audio, speech_timestamps, get_stt_stats
+    return SimpleNamespace(stt=stt, stt_file=stt_file, transcribe_audio=transcribe_audio, speech_timestamps=speech_timestamps, tts=tts, tts_pcm=tts_pcm, check_available=check_available,
+                           stats=lambda: {"stt": get_stt_stats(), "tts": get_tts_stats()})
+
+def _worker_ops(kind):
+    # Imported here so each worker only pulls in the library for its own model
+    if kind == "stt":
+        from utils.speech_recognition import stt, stt_file, transcribe_audio, speech_timestamps
+        return {"stt": stt, "stt_bytes": lambda data, quality=None: stt_file(io.BytesIO(data), quality), "transcribe_audio": transcribe_audio,
+                "speech_timestamps": speech_timestamps}
+    from utils.text_2_speech import tts_pcm
+    return {"tts_pcm": tts_pcm}
+
+def _work(kind, ops, manager):
+    try:
+        _process_jobs(kind, ops, manager)
+    except Exception as e:
+        # Broker gone: exit so the supervisor restarts the worker instead of leaving it heartbeating idle
+        print(f"{kind} worker lost the job broker: {str(e)}")
+        os._exit(1)
+
+def _process_jobs(kind, ops, manager):
+    jobs = manager.get_queue(kind)
+    replies = {}
+    while True:
+        job = jobs.get()
+        if time.time() > job["deadline"]:
+            continue
+        try:
+            result = (True, ops[job["op"]](*job["args"]))
+        except ModelUnavailableError as e:
+            result = (False, {"message": str(e), "model_unavailable": (e.name, e.state)})
+        except Exception as e:
+            print(f"Error in {kind} job {job['op']}: {str(e)}")
+            result = (False, {"message": str(e)})
+        if job["reply_to"] not in replies:
+            replies[job["reply_to"]] = manager.get_queue(job["reply_to"])
+        replies[job["reply_to"]].put((job["id"], *result))
+
+def run_worker(kind, threads):
+    ops = _worker_ops(kind)
+    start_loading("eager")
+    worker_id = uuid4().hex
+    # One broker connection per thread: a proxy blocked in get() can't be shared
+    for i in range(threads):
+        threading.Thread(target=_work, args=(kind, ops, connect()), name=f"{kind}-worker-{i}", daemon=True).start()
+    registry = connect().registry()
+    print(f"{kind} worker {worker_id} running {threads} threads")
+    while True:
+        registry.heartbeat(kind, worker_id)
+        time.sleep(WORKER_HEARTBEAT)
+
+if __name__ == "__main__":
+    if ROLE == "broker":
+        run_broker()
+    elif ROLE in ("stt-worker", "tts-worker"):
+        from utils.executor import stt_executor, tts_executor
+        kind = ROLE.split("-")[0]
+        # Same concurrency as the in-process executors would use for this model
+        run_worker(kind, (stt_executor if kind == "stt" else tts_executor).workers)
+    else:
+        raise SystemExit("Set ROLE to broker, stt-worker or tts-worker")
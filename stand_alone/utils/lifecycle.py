@@ -0,0 +1,120 @@
+from dotenv import load_dotenv
+import os
+import threading
+import time
+load_dotenv()
+
+# all: one process does everything; gateway: HTTP/auth only, speech work goes to workers over
+# the job queue (utils.jobs); stt-worker / tts-worker: run one model for the gateways; broker: the queue
+ROLE = os.getenv("ROLE", "all")
+ROLE_MODELS = {"all": "stt,tts", "gateway": "", "broker": "", "stt-worker": "stt", "tts-worker": "tts"}
+# Which models this process serves, e.g. "stt" for a transcription-only deployment
+MODELS = [m.strip() for m in os.getenv("MODELS", ROLE_MODELS.get(ROLE, "stt,tts")).split(",") if m.strip()]
+# eager: load and warm up before the server accepts requests
+# background: accept requests at once and load in the background; /ready fails until done
+# lazy: load on first use (development and tests; /ready does not wait for models)
+MODEL_LOADING = os.getenv("MODEL_LOADING", "eager")
+LOADING_RETRY_AFTER = int(os.getenv("MODEL_LOADING_RETRY_AFTER", "30"))
+
+class ModelUnavailableError(Exception):
+    def __init__(self, name, state):
+        message = f"{name} is disabled on this server" if state == "disabled" else f"{name} model is {state}"
+        super().__init__(message)
+        self.name = name
+        self.state = state
+        self.retry_after = LOADING_RETRY_AFTER if state in ("pending", "loading") else None
+
+class ModelComponent:
+    """One model's lifecycle: pending -> loading -> ready (or failed), or disabled by MODELS.
+
+    `ensure_ready()` loads and warms the model exactly once. Other threads block until that has
+    finished, or with wait=False raise ModelUnavailableError (with a Retry-After) instead; the loading
+    thread itself may re-enter (warm-up hooks run through the normal code path).
+    """
+
+    def __init__(self, name, load, warm_ups, enabled):
+        self.name = name
+        self.load = load
+        self.warm_ups = list(warm_ups)
+        self.state = "pending" if enabled else "disabled"
+        self.error = None
+        self.load_seconds = None
+        self._lock = threading.RLock()
+        self._loader = None
+
+    def ensure_ready(self, wait=True):
+        if self.state == "ready":
+            return
+        if self.state in ("disabled", "failed"):
+            raise ModelUnavailableError(self.name, self.state)
+        if not wait and self._loader != threading.get_ident():
+            raise ModelUnavailableError(self.name, self.state)
+        with self._lock:
+            if self.state in ("ready", "loading"):
+                return
+            if self.state == "failed":
+                raise ModelUnavailableError(self.name, self.state)
+            self.state = "loading"
+            self._loader = threading.get_ident()
+            start = time.perf_counter()
+            try:
+                self.load()
+                for warm_up in self.warm_ups:
+                    warm_up()
+            except Exception as e:
+                self.state = "failed"
+                self.error = str(e)
+                print(f"Error loading {self.name} model: {str(e)}")
+                raise
+            finally:
+                self._loader = None
+            self.load_seconds = time.perf_counter() - start
+            self.state = "ready"
+            print(f"{self.name} model ready in {self.load_seconds:.1f}s")
+
+    def check_available(self, wait=True):
+        # Non-blocking: fails fast for a disabled or broken model, and with wait=False for one still loading
+        if self.state in ("disabled", "failed") or (not wait and self.state != "ready"):
+            raise ModelUnavailableError(self.name, self.state)
+
+    def status(self):
+        return {"state": self.state, "load_seconds": self.load_seconds, "error": self.error}
+
+models = {}
+# Set by start_loading("background"): requests then get 503 + Retry-After until a model is ready
+# instead of queueing behind its load
+_background = False
+
+def register(name, load, *warm_ups):
+    models[name] = ModelComponent(name, load, warm_ups, name in MODELS)
+
+def require(name):
+    models[name].ensure_ready(wait=not _background)
+
+def check_available(name):
+    models[name].check_available(wait=not _background)
+
+def _load(component):
+    try:
+        component.ensure_ready()
+    except Exception:
+        pass
+
+def start_loading(mode=MODEL_LOADING):
+    global _background
+    _background = mode == "background"
+    enabled = [c for c in models.values() if c.state != "disabled"]
+    if mode == "eager":
+        for component in enabled:
+            component.ensure_ready()
+    elif mode == "background":
+        for component in enabled:
+            threading.Thread(target=_load, args=(component,), name=f"load-{component.name}", daemon=True).start()
+
+def readiness():
+    states = {name: c.status() for name, c in models.items()}
+    if MODEL_LOADING == "lazy":
+        ready = all(c.state != "failed" for c in models.values())
+    else:
+        ready = all(c.state in ("ready", "disabled") for c in models.values())
+    return {"ready": ready, "loading": MODEL_LOADING, "models": states}
@@ -0,0 +1,139 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+import re
+import threading
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+class Histogram:
+    """Prometheus-style cumulative histogram, one series per combination of label values."""
+
+    def __init__(self, name, documentation, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: {"buckets": list(v["buckets"]), "sum": v["sum"], "count": v["count"]} for k, v in self._series.items()}
+        for label_values, data in sorted(series.items()):
+            labels = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, label_values))
+            sep = "," if labels else ""
+            for bound, count in zip(self.buckets, data["buckets"]):
+                lines.append(f'{self.name}_bucket{{{labels}{sep}le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}{sep}le="+Inf"}} {data["count"]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {data['sum']}")
+            lines.append(f"{self.name}_count{{{labels}}} {data['count']}")
+        return lines
+
+stage_seconds = Histogram("drishti_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+gemini_seconds = Histogram("drishti_gemini_seconds", "Gemini call duration per model and outcome (ok, error, timeout).", ("model", "outcome"))
+request_seconds = Histogram("drishti_request_seconds", "HTTP request duration, from the first byte received to the last byte sent.", ("method", "route", "status"))
+_in_flight = 0
+
+class RequestTimings:
+    """Per-request stage durations, reported in the Server-Timing response header."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.durations[stage] = self.durations.get(stage, 0.0) + seconds
+
+    def header(self):
+        with self._lock:
+            durations = dict(self.durations)
+        durations["total"] = time.perf_counter() - self.start
+        return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in durations.items())
+
+_request_timings = ContextVar("request_timings", default=None)
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def request_decoded():
+    # Call once the handler has its parsed input: everything since the first byte is receive + parse time
+    timings = _request_timings.get()
+    if timings is not None:
+        observe_stage("request_decode", time.perf_counter() - timings.start)
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: times every request, tracks in-flight requests and adds Server-Timing."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        global _in_flight
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        timings = RequestTimings()
+        token = _request_timings.set(timings)
+        status = 500
+        response_start = None
+
+        async def send_with_timing(message):
+            nonlocal status, response_start
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                response_start = time.perf_counter()
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timings.header().encode())]}
+            await send(message)
+
+        _in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _in_flight -= 1
+            _request_timings.reset(token)
+            end = time.perf_counter()
+            if response_start is not None:
+                stage_seconds.observe(end - response_start, "response_send")
+            # The route template, not the raw path, keeps the label set bounded
+            route = scope.get("route")
+            request_seconds.observe(end - timings.start, scope["method"], getattr(route, "path", "unmatched"), str(status))
+
+def _gauges(prefix, value, lines):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _gauges(f"{prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', str(key))}", item, lines)
+    elif isinstance(value, (bool, int, float)) and value == value and abs(value) != float("inf"):
+        lines.append(f"{prefix} {value if isinstance(value, float) else int(value)}")
+
+def render_metrics(stats):
+    """Histograms plus every numeric value in `stats` (the /stats payload) as a gauge."""
+    lines = stage_seconds.render() + request_seconds.render() + gemini_seconds.render()
+    lines += ["# TYPE drishti_requests_in_flight gauge", f"drishti_requests_in_flight {_in_flight}"]
+    _gauges("drishti", stats, lines)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,98 @@
+from utils.audio import DEFAULT_VOICE
+from utils.metrics import stage_seconds
+import asyncio
+import re
+import threading
+import time
+
+SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+
+_stats_lock = threading.Lock()
+pipeline_stats = {"count": 0}
+
+class StageTimings:
+    """Seconds from request start until each named stage was first reached."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = {}
+
+    def mark(self, stage):
+        self.marks.setdefault(stage, time.perf_counter() - self.start)
+
+    def as_dict(self):
+        return dict(self.marks)
+
+def record_timings(timings: StageTimings):
+    with _stats_lock:
+        pipeline_stats["count"] += 1
+        for stage, seconds in timings.marks.items():
+            pipeline_stats[f"{stage}_seconds_sum"] = pipeline_stats.get(f"{stage}_seconds_sum", 0.0) + seconds
+    # Marks are offsets from the request start, too late for Server-Timing, so they only go to the histogram
+    for stage, seconds in timings.marks.items():
+        stage_seconds.observe(seconds, f"stream_{stage}")
+
+def get_pipeline_stats():
+    with _stats_lock:
+        stats = dict(pipeline_stats)
+    count = stats["count"]
+    for key in [k for k in stats if k.endswith("_seconds_sum")]:
+        stats[key.replace("_seconds_sum", "_seconds_avg")] = stats[key] / count if count else 0.0
+    return stats
+
+async def split_sentences(text_chunks):
+    # Re-chunks a stream of arbitrary text pieces into whole sentences
+    buffer = ''
+    async for chunk in text_chunks:
+        buffer += chunk
+        parts = SENTENCE_END.split(buffer)
+        buffer = parts.pop()
+        for sentence in parts:
+            if sentence.strip():
+                yield sentence.strip()
+    if buffer.strip():
+        yield buffer.strip()
+
+async def _mark_llm(text_chunks, timings):
+    async for chunk in text_chunks:
+        timings.mark("llm_first_token")
+        yield chunk
+    timings.mark("llm_done")
+
+async def pipelined_tts(text_chunks, executor, timings=None, voice=DEFAULT_VOICE, speed=1, synthesize=None):
+    """Synthesizes each sentence of a streaming answer while later text is still arriving.
+
+    `text_chunks` is any async iterable of text (the Gemini stream, or a fake one).
+    `synthesize(text, voice, speed) -> PCM` is the local tts_pcm (the default) or a remote worker call.
+    Yields 16-bit PCM per sentence. One slot on `executor` is held for the whole stream.
+    """
+    if synthesize is None:
+        from utils.text_2_speech import tts_pcm as synthesize
+    timings = timings or StageTimings()
+    executor.try_admit()
+    sentences = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for sentence in split_sentences(_mark_llm(text_chunks, timings)):
+                await sentences.put(sentence)
+        finally:
+            await sentences.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            pcm = await executor.call(synthesize, sentence, voice, speed)
+            if pcm:
+                timings.mark("first_audio")
+                yield pcm
+        await producer
+    finally:
+        if not producer.done():
+            producer.cancel()
+        executor.release()
+        timings.mark("total")
+        record_timings(timings)
@@ -1,23 +1,310 @@
-from faster_whisper import WhisperModel
-import tempfile
+from faster_whisper import WhisperModel, BatchedInferencePipeline, decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+from concurrent.futures import Future
+from dotenv import load_dotenv
+from utils.metrics import timed
+from utils.lifecycle import register, require, ModelUnavailableError
+from utils.audio import STT_SAMPLE_RATE, STT_BEAM_SIZE, CHUNK_SECONDS, QUALITIES, AudioTooLargeError, InvalidQualityError, check_quality
+import numpy as np
+import bisect
+import threading
 import base64
+import queue
+import time
+import io
+import os
+import av
+load_dotenv()
 
-model_size = "distil-large-v3"
-model = WhisperModel(model_size, device="cpu", compute_type="int8")
+model_size = os.getenv("STT_MODEL", "distil-large-v3")
+STT_DEVICE = os.getenv("STT_DEVICE", "cpu")
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "int8")
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "0"))
+STT_VAD_FILTER = os.getenv("STT_VAD_FILTER", "false").lower() in ("1", "true", "yes")
+STT_LANGUAGE = os.getenv("STT_LANGUAGE") or None
+# STT_BATCH_SIZE > 1 enables cross-request micro-batching
+STT_BATCH_SIZE = int(os.getenv("STT_BATCH_SIZE", "1"))
+STT_BATCH_WAIT_MS = float(os.getenv("STT_BATCH_WAIT_MS", "50"))
+STT_INFERENCE_BATCH_SIZE = int(os.getenv("STT_INFERENCE_BATCH_SIZE", "8"))
+# Cascade: a small model (e.g. base.en, tiny) transcribes first and STT_MODEL only re-runs low-confidence audio
+STT_CASCADE_MODEL = os.getenv("STT_CASCADE_MODEL") or None
+STT_CASCADE_BEAM_SIZE = int(os.getenv("STT_CASCADE_BEAM_SIZE", "1"))
+STT_CASCADE_MIN_LOGPROB = float(os.getenv("STT_CASCADE_MIN_LOGPROB", "-0.5"))
+STT_CASCADE_MAX_NO_SPEECH = float(os.getenv("STT_CASCADE_MAX_NO_SPEECH", "0.6"))
+STT_CASCADE_MAX_COMPRESSION = float(os.getenv("STT_CASCADE_MAX_COMPRESSION", "2.4"))
 
+SAMPLE_RATE = STT_SAMPLE_RATE
+MAX_AUDIO_BYTES = int(os.getenv("MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("MAX_AUDIO_SECONDS", "120"))
 
-def decode_base64_to_temp(base64_audio: str, audio_format) -> str:
-    audio_data = base64.b64decode(base64_audio)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{audio_format}") as f:
-        f.write(audio_data)
-        return f.name
+def decode_base64_to_buffer(base64_audio: str):
+    # base64 is 4 chars per 3 bytes, so the size can be checked before anything is decoded
+    if len(base64_audio) * 3 // 4 > MAX_AUDIO_BYTES:
+        raise AudioTooLargeError(f"Audio exceeds {MAX_AUDIO_BYTES} bytes")
+    # The payload is already in memory as text, and MAX_AUDIO_BYTES bounds the decoded copy; BytesIO shares it
+    with timed("base64_decode"):
+        return io.BytesIO(base64.b64decode(base64_audio))
 
-def stt(base64_audio: str, audio_type: str) -> str:
+def _check_size(audio_file):
+    audio_file.seek(0, io.SEEK_END)
+    size = audio_file.tell()
+    audio_file.seek(0)
+    if size > MAX_AUDIO_BYTES:
+        raise AudioTooLargeError(f"Audio exceeds {MAX_AUDIO_BYTES} bytes")
+
+def _probe_duration(audio_file):
+    # Container-level duration from the header; None when the format doesn't declare one
+    try:
+        with av.open(audio_file, mode="r") as container:
+            if container.duration is not None:
+                return container.duration / av.time_base
+    except Exception:
+        pass
+    finally:
+        audio_file.seek(0)
+    return None
+
+def load_audio(audio_file):
+    # Decodes and resamples to 16 kHz mono float32 in process, enforcing the byte and duration limits first
+    with timed("stt_decode"):
+        return _load_audio(audio_file)
+
+def _load_audio(audio_file):
+    _check_size(audio_file)
+    duration = _probe_duration(audio_file)
+    if duration is not None and duration > MAX_AUDIO_SECONDS:
+        raise AudioTooLargeError(f"Audio is longer than {MAX_AUDIO_SECONDS:g} seconds")
+    audio = decode_audio(audio_file, sampling_rate=SAMPLE_RATE)
+    if len(audio) > MAX_AUDIO_SECONDS * SAMPLE_RATE:
+        raise AudioTooLargeError(f"Audio is longer than {MAX_AUDIO_SECONDS:g} seconds")
+    return audio
+
+def speech_timestamps(audio, min_silence_ms, max_speech_seconds=CHUNK_SECONDS):
+    # Silero VAD regions as {"start", "end"} sample offsets
+    return get_speech_timestamps(audio, VadOptions(min_silence_duration_ms=min_silence_ms, max_speech_duration_s=max_speech_seconds))
+
+def _speech_clips(audio):
+    # Sample ranges to transcribe for one request, each no longer than a Whisper window
+    if STT_VAD_FILTER:
+        return [(c["start"], c["end"]) for c in speech_timestamps(audio, 160)]
+    window = CHUNK_SECONDS * SAMPLE_RATE
+    return [(start, min(start + window, len(audio))) for start in range(0, len(audio), window)]
+
+class BatchScheduler:
+    """Collects transcription requests for up to `max_wait_ms` and runs them as one batched inference.
+
+    Request audio is laid end to end and every speech clip is passed to faster-whisper's
+    BatchedInferencePipeline as an explicit clip timestamp, so no clip spans two requests.
+    Segments are routed back to their request by start time.
+    """
+
+    def __init__(self, whisper_model, max_batch_size=STT_BATCH_SIZE, max_wait_ms=STT_BATCH_WAIT_MS):
+        self.pipeline = BatchedInferencePipeline(model=whisper_model)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self._thread = threading.Thread(target=self._loop, name="stt-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, audio) -> Future:
+        future = Future()
+        self._queue.put((audio, future))
+        return future
+
+    def transcribe(self, audio) -> str:
+        return self.submit(audio).result()
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _run(self, batch):
+        live = [(audio, future) for audio, future in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        futures = [future for _, future in live]
+        try:
+            texts = self._transcribe_batch([audio for audio, _ in live])
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.requests += len(futures)
+        for future, text in zip(futures, texts):
+            future.set_result(text)
+
+    def _transcribe_batch(self, audios):
+        starts, clips, offset = [], [], 0
+        for audio in audios:
+            starts.append(offset / SAMPLE_RATE)
+            clips += [{"start": (offset + a) / SAMPLE_RATE, "end": (offset + b) / SAMPLE_RATE} for a, b in _speech_clips(audio)]
+            offset += len(audio)
+        texts = [""] * len(audios)
+        if not clips:
+            return texts
+        segments, _ = self.pipeline.transcribe(
+            np.concatenate(audios).astype(np.float32),
+            beam_size=STT_BEAM_SIZE,
+            language=STT_LANGUAGE,
+            clip_timestamps=clips,
+            batch_size=STT_INFERENCE_BATCH_SIZE,
+        )
+        for segment in segments:
+            # Segment times are rounded to milliseconds, so allow a little slack at request boundaries
+            index = max(0, bisect.bisect_right(starts, segment.start + 0.005) - 1)
+            texts[index] += segment.text
+        return texts
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": self.requests / self.batches if self.batches else 0.0,
+                "queued": self._queue.qsize(),
+            }
+
+# Loaded by the lifecycle manager (utils.lifecycle), not at import time
+model = None
+fast_model = None
+batcher = None
+
+_cascade_lock = threading.Lock()
+cascade_stats = {"fast_only": 0, "accepted": 0, "escalated": 0, "accurate_only": 0}
+
+def load_model():
+    global model, fast_model, batcher
+    model = WhisperModel(model_size, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE, cpu_threads=STT_CPU_THREADS)
+    # Both models stay resident, so an escalation never waits for a load
+    if STT_CASCADE_MODEL:
+        fast_model = WhisperModel(STT_CASCADE_MODEL, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE, cpu_threads=STT_CPU_THREADS)
+    batcher = BatchScheduler(model) if STT_BATCH_SIZE > 1 else None
+
+def warm_up():
+    # One pass over a second of silence, so the first real request doesn't pay for lazy initialization
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    _run_transcription(silence)
+    if fast_model is not None:
+        _fast_transcription(silence)
+
+register("stt", load_model, warm_up)
+
+def _record_cascade(outcome):
+    with _cascade_lock:
+        cascade_stats[outcome] += 1
+
+def get_stt_stats():
+    stats = {"model": model_size, "batching": batcher.stats() if batcher else None, "cascade": None}
+    if STT_CASCADE_MODEL:
+        with _cascade_lock:
+            cascade = dict(cascade_stats)
+        checked = cascade["accepted"] + cascade["escalated"]
+        cascade["escalation_rate"] = cascade["escalated"] / checked if checked else 0.0
+        stats["cascade"] = {"model": STT_CASCADE_MODEL, **cascade}
+    return stats
+
+def _confident(segments) -> bool:
+    # Low average log-probability, a likely non-speech window that still produced text, or the
+    # repetition loops that show up as a high compression ratio all send the audio to the large model
+    for segment in segments:
+        if segment.avg_logprob < STT_CASCADE_MIN_LOGPROB:
+            return False
+        if segment.no_speech_prob > STT_CASCADE_MAX_NO_SPEECH and segment.text.strip():
+            return False
+        if getattr(segment, "compression_ratio", 0.0) > STT_CASCADE_MAX_COMPRESSION:
+            return False
+    return True
+
+def _fast_transcription(audio, initial_prompt=None):
+    segments, _ = fast_model.transcribe(audio, beam_size=STT_CASCADE_BEAM_SIZE, vad_filter=STT_VAD_FILTER, language=STT_LANGUAGE,
+                                        initial_prompt=initial_prompt)
+    return list(segments)
+
+def _cascade(audio, quality, accurate, initial_prompt=None) -> str:
+    # `accurate(audio)` runs STT_MODEL; without a cascade model every quality ends up there
+    if fast_model is None or quality == "accurate":
+        if fast_model is not None:
+            _record_cascade("accurate_only")
+        with timed("stt_transcribe"):
+            return accurate(audio)
+    with timed("stt_fast"):
+        segments = _fast_transcription(audio, initial_prompt)
+    if quality == "fast":
+        _record_cascade("fast_only")
+        return "".join([segment.text for segment in segments])
+    if _confident(segments):
+        _record_cascade("accepted")
+        return "".join([segment.text for segment in segments])
+    _record_cascade("escalated")
+    with timed("stt_transcribe"):
+        return accurate(audio)
+
+def _transcribe(audio, quality=None) -> str:
+    return _cascade(audio, quality, _run_transcription)
+
+def _run_transcription(audio) -> str:
+    if batcher is not None:
+        return batcher.transcribe(audio)
+    segments, _ = model.transcribe(audio, beam_size=STT_BEAM_SIZE, vad_filter=STT_VAD_FILTER, language=STT_LANGUAGE)
+    return "".join([segment.text for segment in segments])
+
+def transcribe_audio(audio, beam_size=STT_BEAM_SIZE, initial_prompt=None, quality=None) -> str:
+    # One utterance already cut by the caller's VAD (live streams); skips the batcher, whose wait would delay every partial
+    require("stt")
+
+    def accurate(audio):
+        segments, _ = model.transcribe(audio, beam_size=beam_size, vad_filter=False, language=STT_LANGUAGE,
+                                       initial_prompt=initial_prompt, condition_on_previous_text=False)
+        return "".join([segment.text for segment in segments])
+    return _cascade(audio, check_quality(quality), accurate, initial_prompt)
+
+def stt(base64_audio: str, audio_type: str, quality=None) -> str:
+    # audio_type is kept for API compatibility; PyAV detects the container from the data itself
+    try:
+        quality = check_quality(quality)
+        require("stt")
+        with decode_base64_to_buffer(base64_audio) as audio_file:
+            audio = load_audio(audio_file)
+        return {"text": _transcribe(audio, quality), "flag": True}
+    except InvalidQualityError as e:
+        return {"text": str(e), "flag": False, "status": 400}
+    except AudioTooLargeError as e:
+        return {"text": str(e), "flag": False, "status": 413}
+    except ModelUnavailableError:
+        raise
+    except Exception as e:
+        print(f"Error in stt: {str(e)}")
+        return {"text": "Failed to process audio", "flag": False}
+
+def stt_file(audio_file, quality=None) -> str:
     try:
-        audio_path = decode_base64_to_temp(base64_audio, audio_type)
-        segments, _ = model.transcribe(audio_path, beam_size=5)
-        transcription = "".join([segment.text for segment in segments])
-        return {"text": transcription, "flag": True}
+        quality = check_quality(quality)
+        require("stt")
+        audio = load_audio(audio_file)
+        return {"text": _transcribe(audio, quality), "flag": True}
+    except InvalidQualityError as e:
+        return {"text": str(e), "flag": False, "status": 400}
+    except AudioTooLargeError as e:
+        return {"text": str(e), "flag": False, "status": 413}
+    except ModelUnavailableError:
+        raise
     except Exception as e:
+        print(f"Error in stt_file: {str(e)}")
         return {"text": "Failed to process audio", "flag": False}
-    
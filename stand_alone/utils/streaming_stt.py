@@ -0,0 +1,212 @@
+from fastapi import WebSocket
+from dotenv import load_dotenv
+from utils.audio import STT_SAMPLE_RATE as SAMPLE_RATE, STT_BEAM_SIZE, AudioTooLargeError, check_quality
+from utils.executor import QueueFullError
+import numpy as np
+import asyncio
+import threading
+import json
+import os
+import av
+load_dotenv()
+
+# A partial hypothesis is produced for every STREAM_PARTIAL_SECONDS of new audio, greedily;
+# an utterance becomes final after STREAM_SILENCE_MS of silence and is re-transcribed with the full beam
+STREAM_PARTIAL_SECONDS = float(os.getenv("STREAM_PARTIAL_SECONDS", "1.0"))
+STREAM_SILENCE_MS = int(os.getenv("STREAM_SILENCE_MS", "600"))
+STREAM_PARTIAL_BEAM_SIZE = int(os.getenv("STREAM_PARTIAL_BEAM_SIZE", "1"))
+STREAM_MAX_SECONDS = float(os.getenv("STREAM_MAX_SECONDS", "300"))
+STREAM_PROMPT_CHARS = 200
+FORMATS = ("pcm16", "opus")
+
+class StreamFormatError(ValueError):
+    pass
+
+class PCM16Decoder:
+    """Raw little-endian 16-bit mono PCM, resampled to 16 kHz when sent at another rate."""
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self._carry = b""
+        self._resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE) if sample_rate != SAMPLE_RATE else None
+
+    def decode(self, data: bytes):
+        # A chunk boundary may fall inside a sample
+        data = self._carry + data
+        usable = len(data) - len(data) % 2
+        self._carry = data[usable:]
+        samples = np.frombuffer(data[:usable], dtype="<i2")
+        if self._resampler is None:
+            return samples.astype(np.float32) / 32768
+        frame = av.AudioFrame.from_ndarray(samples[None, :], format="s16", layout="mono")
+        frame.sample_rate = self.sample_rate
+        return _frames_to_array(self._resampler.resample(frame))
+
+class OpusDecoder:
+    """One Opus packet per message (WebCodecs AudioEncoder, MediaCodec), without an Ogg/WebM container."""
+
+    def __init__(self):
+        self._codec = av.CodecContext.create("opus", "r")
+        self._resampler = av.AudioResampler(format="flt", layout="mono", rate=SAMPLE_RATE)
+
+    def decode(self, data: bytes):
+        frames = []
+        for frame in self._codec.decode(av.Packet(data)):
+            frames += self._resampler.resample(frame)
+        return _frames_to_array(frames)
+
+def _frames_to_array(frames):
+    if not frames:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate([frame.to_ndarray().reshape(-1) for frame in frames]).astype(np.float32)
+
+def make_decoder(audio_format, sample_rate=SAMPLE_RATE):
+    if audio_format == "pcm16":
+        if not 8000 <= sample_rate <= 48000:
+            raise StreamFormatError("sample_rate must be between 8000 and 48000")
+        return PCM16Decoder(sample_rate)
+    if audio_format == "opus":
+        return OpusDecoder()
+    raise StreamFormatError(f"format must be one of {', '.join(FORMATS)}")
+
+class StreamingTranscriber:
+    """Incremental, VAD-segmented transcription of one live audio stream.
+
+    `add()` buffers 16 kHz samples as they arrive; `step()` runs the VAD (`speech_timestamps`) over the buffer, transcribes
+    every utterance followed by enough silence as a final and drops it from the buffer, then
+    re-transcribes the utterance still open as a partial, with the cascade's fast model when there is
+    one (finals use `quality`). `step()` blocks on the model, so it runs on the stt executor while
+    `add()` keeps being called from the event loop. Both models come from the speech backend, so on a
+    gateway they run on the STT workers.
+    """
+
+    def __init__(self, transcribe, speech_timestamps, partial_seconds=STREAM_PARTIAL_SECONDS, silence_ms=STREAM_SILENCE_MS,
+                 partial_beam_size=STREAM_PARTIAL_BEAM_SIZE, quality=None):
+        self.transcribe = transcribe
+        self.speech_timestamps = speech_timestamps
+        self.quality = check_quality(quality)
+        self.partial_samples = int(partial_seconds * SAMPLE_RATE)
+        self.silence_ms = silence_ms
+        self.silence_samples = silence_ms * SAMPLE_RATE // 1000
+        self.partial_beam_size = partial_beam_size
+        self.finals = []
+        self._lock = threading.Lock()
+        self._buffer = np.zeros(0, dtype=np.float32)
+        self._offset = 0
+        self._new = 0
+        self._received = 0
+        self._partial = ""
+
+    @property
+    def text(self):
+        return " ".join(self.finals)
+
+    def add(self, samples):
+        with self._lock:
+            if self._received + len(samples) > STREAM_MAX_SECONDS * SAMPLE_RATE:
+                raise AudioTooLargeError(f"Stream is longer than {STREAM_MAX_SECONDS:g} seconds")
+            self._buffer = np.concatenate([self._buffer, samples])
+            self._new += len(samples)
+            self._received += len(samples)
+
+    def due(self):
+        return self._new >= self.partial_samples
+
+    def _consume(self, samples):
+        with self._lock:
+            self._buffer = self._buffer[samples:]
+            self._offset += samples
+
+    def _prompt(self):
+        # The tail of what was already said keeps spelling and context consistent across utterances
+        return self.text[-STREAM_PROMPT_CHARS:] or None
+
+    def step(self, final=False):
+        # With final=True the stream has ended: whatever is still open is finalized, no partial is sent
+        with self._lock:
+            audio, offset = self._buffer, self._offset
+            self._new = 0
+        events = []
+        regions = self.speech_timestamps(audio, self.silence_ms) if len(audio) else []
+        if not regions:
+            # Keep a short tail in case speech is just starting
+            self._consume(len(audio) if final else max(0, len(audio) - self.silence_samples))
+            return events
+        closed = regions if final else [r for r in regions if r["end"] + self.silence_samples <= len(audio)]
+        if closed:
+            start, end = closed[0]["start"], closed[-1]["end"]
+            text = self.transcribe(audio[start:end], STT_BEAM_SIZE, self._prompt(), self.quality).strip()
+            if text:
+                self.finals.append(text)
+                events.append({"type": "final", "text": text, "start": (offset + start) / SAMPLE_RATE, "end": (offset + end) / SAMPLE_RATE})
+            self._partial = ""
+            self._consume(end)
+        if not final and len(closed) < len(regions):
+            start = regions[len(closed)]["start"]
+            text = self.transcribe(audio[start:], self.partial_beam_size, self._prompt(), "fast").strip()
+            if text and text != self._partial:
+                self._partial = text
+                events.append({"type": "partial", "text": text})
+        return events
+
+async def _send_step(websocket: WebSocket, transcriber, executor, final=False):
+    try:
+        events = await executor.run(transcriber.step, final)
+    except QueueFullError as e:
+        if not final:
+            # The audio stays buffered and goes into the next step
+            return True
+        events = [{"type": "error", "message": f"Server busy ({e.name}), retry later", "retry_after": e.retry_after}]
+    except Exception as e:
+        print(f"Error in streaming transcription: {str(e)}")
+        events = [{"type": "error", "message": str(e) if isinstance(e, AudioTooLargeError) else "Failed to process audio"}]
+    for event in events:
+        await websocket.send_json(event)
+    return not events or events[-1]["type"] != "error"
+
+async def transcribe_websocket(websocket: WebSocket, transcriber, decoder, executor):
+    """Runs one accepted streaming session until the client sends {"type": "end"}.
+
+    Binary messages are audio, text messages JSON control messages. Partials and finals are sent
+    as they become available, then a "transcript" message with the full text. Returns the "end"
+    message, or None when the client went away or the session failed.
+    """
+    stepping = None
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return None
+            if message.get("bytes") is not None:
+                try:
+                    transcriber.add(decoder.decode(message["bytes"]))
+                except AudioTooLargeError as e:
+                    await websocket.send_json({"type": "error", "message": str(e)})
+                    return None
+                except Exception as e:
+                    print(f"Error decoding audio stream: {str(e)}")
+                    await websocket.send_json({"type": "error", "message": "Invalid audio"})
+                    return None
+                # One step at a time; audio that arrives meanwhile is picked up by the next one
+                if transcriber.due() and (stepping is None or stepping.done()):
+                    stepping = asyncio.create_task(_send_step(websocket, transcriber, executor))
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    control = None
+                if not isinstance(control, dict):
+                    await websocket.send_json({"type": "error", "message": "Control messages must be JSON objects"})
+                    continue
+                if control.get("type") == "end":
+                    break
+        if stepping is not None and not await stepping:
+            return None
+        stepping = None
+        if not await _send_step(websocket, transcriber, executor, final=True):
+            return None
+        await websocket.send_json({"type": "transcript", "text": transcriber.text})
+        return control
+    finally:
+        if stepping is not None:
+            stepping.cancel()
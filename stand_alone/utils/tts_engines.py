@@ -0,0 +1,234 @@
+from kokoro import KPipeline, KModel
+from huggingface_hub import hf_hub_download
+from dotenv import load_dotenv
+import numpy as np
+import argparse
+import threading
+import json
+import time
+import sys
+import os
+import torch
+from utils.audio import TTS_SAMPLE_RATE as SAMPLE_RATE
+load_dotenv()
+
+# torch: Kokoro's PyTorch KModel. onnx: the same model exported to ONNX (optionally int8-quantized) and run
+# by ONNX Runtime. KPipeline does text normalization, G2P and chunking for both, so they read the same phonemes
+TTS_ENGINE = os.getenv("TTS_ENGINE", "torch")
+TTS_ONNX_MODEL = os.getenv("TTS_ONNX_MODEL", "kokoro-v1.0.onnx")
+# Threads per synthesis call; 0 keeps the library default (one per core). Up to TTS_WORKERS calls run
+# at once, so on a dedicated node cores / TTS_WORKERS intra-op threads avoids oversubscription
+TTS_INTRA_OP_THREADS = int(os.getenv("TTS_INTRA_OP_THREADS", "0"))
+TTS_INTER_OP_THREADS = int(os.getenv("TTS_INTER_OP_THREADS", "0"))
+KOKORO_REPO = "hexgrad/Kokoro-82M"
+
+class TorchEngine:
+    """Kokoro's PyTorch KModel; every pipeline shares the one model."""
+
+    name = "torch"
+
+    def __init__(self, intra_op_threads=TTS_INTRA_OP_THREADS, inter_op_threads=TTS_INTER_OP_THREADS):
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.model = None
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def load(self):
+        # Thread counts are process-wide in PyTorch, and the inter-op pool can only be sized before it starts
+        if self.intra_op_threads:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError as e:
+                print(f"Error setting TTS inter-op threads: {str(e)}")
+        self.model = KModel().eval()
+
+    def pipeline(self, lang_code):
+        return KPipeline(lang_code=lang_code, model=self.model)
+
+    def synthesize(self, pipeline, text, voice, speed):
+        for _, _, audio in pipeline(text, voice=voice, speed=speed):
+            if audio is None:
+                continue
+            if isinstance(audio, torch.Tensor):
+                audio = audio.detach().cpu().numpy()
+            yield np.asarray(audio, dtype=np.float32)
+
+    def describe(self):
+        return {"engine": self.name, "intra_op_threads": self.intra_op_threads, "inter_op_threads": self.inter_op_threads}
+
+class OnnxEngine:
+    """Kokoro exported to ONNX, run by ONNX Runtime on the CPU.
+
+    Pipelines are KPipelines without a model: they still split and phonemize the text, and this engine
+    turns each chunk's phonemes into token ids and runs the session. The one InferenceSession is shared
+    by every pipeline; `run()` is thread-safe and each call gets its own intra-op threads.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path=TTS_ONNX_MODEL, intra_op_threads=TTS_INTRA_OP_THREADS, inter_op_threads=TTS_INTER_OP_THREADS):
+        self.model_path = model_path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.session = None
+        self._voices = {}
+        self._voices_lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.session is not None
+
+    def load(self):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("TTS_ENGINE=onnx requires the onnxruntime package")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        # The graph is mostly one chain of ops; running branches in parallel only pays with inter-op threads to spare
+        options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if self.inter_op_threads > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        # Exports differ in input names ("input_ids" or "tokens") and in the speed dtype
+        inputs = {i.name: i for i in session.get_inputs()}
+        self._tokens = next(name for name in inputs if name not in ("style", "speed"))
+        self._speed_dtype = np.int32 if "int" in inputs["speed"].type else np.float32
+        with open(hf_hub_download(repo_id=KOKORO_REPO, filename="config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        self.vocab = config["vocab"]
+        self.context_length = config["plbert"]["max_position_embeddings"]
+        self.session = session
+
+    def pipeline(self, lang_code):
+        return KPipeline(lang_code=lang_code, repo_id=KOKORO_REPO, model=False)
+
+    def _voice(self, pipeline, voice):
+        # Voice packs (and blends like "af_heart,af_bella") are loaded by KPipeline once, then kept as numpy
+        with self._voices_lock:
+            pack = self._voices.get(voice)
+        if pack is None:
+            pack = pipeline.load_voice(voice).detach().cpu().numpy().astype(np.float32)
+            with self._voices_lock:
+                self._voices[voice] = pack
+        return pack
+
+    def infer(self, phonemes, pack, speed):
+        ids = [i for i in map(self.vocab.get, phonemes) if i]
+        if len(ids) + 2 > self.context_length:
+            raise ValueError(f"{len(ids)} phonemes exceed the model's context of {self.context_length}")
+        audio = self.session.run(None, {
+            self._tokens: np.array([[0, *ids, 0]], dtype=np.int64),
+            # The style vector depends on the utterance length, as in KModel
+            "style": pack[len(phonemes) - 1].reshape(1, -1),
+            "speed": np.array([speed], dtype=self._speed_dtype),
+        })[0]
+        return audio.reshape(-1).astype(np.float32)
+
+    def synthesize(self, pipeline, text, voice, speed):
+        pack = self._voice(pipeline, voice)
+        for _, phonemes, _ in pipeline(text, voice=voice, speed=speed):
+            if phonemes:
+                yield self.infer(phonemes, pack, speed)
+
+    def describe(self):
+        return {"engine": self.name, "model": self.model_path, "intra_op_threads": self.intra_op_threads,
+                "inter_op_threads": self.inter_op_threads}
+
+ENGINES = {"torch": TorchEngine, "onnx": OnnxEngine}
+
+def make_engine(name=TTS_ENGINE, **options):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown TTS_ENGINE: {name}")
+    return ENGINES[name](**options)
+
+# Parity: waveforms never match sample for sample (Kokoro's vocoder adds noise, and int8 weights round),
+# so engines are compared on duration and on their log-magnitude spectrograms
+PARITY_TEXTS = [
+    "There is a red mug on the desk.",
+    "The image shows a busy street with two cars, a cyclist and a bus stop on the left.",
+    "I couldn't read the label, but it looks like a bottle of olive oil.",
+]
+PARITY_MAX_LENGTH_DIFF = 0.05
+PARITY_MIN_SIMILARITY = 0.9
+
+def spectrogram(audio, frame=1024, hop=256):
+    if len(audio) < frame:
+        audio = np.pad(audio, (0, frame - len(audio)))
+    frames = np.lib.stride_tricks.sliding_window_view(audio, frame)[::hop] * np.hanning(frame)
+    return np.log(np.abs(np.fft.rfft(frames, axis=1)) + 1e-5)
+
+def spectral_similarity(a, b):
+    # Correlation of the two log spectrograms over the frames both have
+    a, b = spectrogram(a), spectrogram(b)
+    n = min(len(a), len(b))
+    return float(np.corrcoef(a[:n].ravel(), b[:n].ravel())[0, 1])
+
+def _render(engine, pipeline, text, voice, speed):
+    start = time.perf_counter()
+    chunks = list(engine.synthesize(pipeline, text, voice, speed))
+    seconds = time.perf_counter() - start
+    return (np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.float32)), seconds
+
+def compare(reference, candidate, texts=PARITY_TEXTS, voice="af_heart", speed=1, lang_code=None):
+    """Synthesizes each text with both engines; returns one row per text, with timings and real-time factors."""
+    for engine in (reference, candidate):
+        if not engine.loaded:
+            engine.load()
+    lang_code = lang_code or voice[0]
+    pipelines = reference.pipeline(lang_code), candidate.pipeline(lang_code)
+    rows = []
+    for text in texts:
+        (a, a_seconds), (b, b_seconds) = (_render(e, p, text, voice, speed) for e, p in zip((reference, candidate), pipelines))
+        length_diff = abs(len(a) - len(b)) / max(len(a), 1)
+        similarity = spectral_similarity(a, b)
+        rows.append({
+            "text": text,
+            "audio_seconds": [len(a) / SAMPLE_RATE, len(b) / SAMPLE_RATE],
+            "synthesis_seconds": [a_seconds, b_seconds],
+            "rtf": [a_seconds * SAMPLE_RATE / max(len(a), 1), b_seconds * SAMPLE_RATE / max(len(b), 1)],
+            "length_diff": length_diff,
+            "similarity": similarity,
+            "ok": length_diff <= PARITY_MAX_LENGTH_DIFF and similarity >= PARITY_MIN_SIMILARITY,
+        })
+    return rows
+
+def quantize(model_path, output_path, op_types=("MatMul", "Gemm", "LSTM")):
+    # Dynamic int8 weights for the text encoder and predictor; the vocoder's convolutions stay float
+    # by default, they are what int8 hurts audibly. Check the result with `compare` before deploying it
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    quantize_dynamic(model_path, output_path, op_types_to_quantize=list(op_types), weight_type=QuantType.QInt8)
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description="Compare or quantize Kokoro TTS engines (run from backend/ or stand_alone/).")
+    commands = parser.add_subparsers(dest="command", required=True)
+    check = commands.add_parser("compare", help="output parity and real-time factor of two engines")
+    check.add_argument("--reference", choices=ENGINES, default="torch")
+    check.add_argument("--candidate", choices=ENGINES, default="onnx")
+    check.add_argument("--model", default=TTS_ONNX_MODEL, help="ONNX model for the onnx engine")
+    check.add_argument("--voice", default="af_heart")
+    check.add_argument("--text", action="append", help="text to synthesize (repeatable)")
+    convert = commands.add_parser("quantize", help="write an int8 copy of an ONNX model")
+    convert.add_argument("model")
+    convert.add_argument("output")
+    convert.add_argument("--ops", default="MatMul,Gemm,LSTM", help="op types to quantize")
+    args = parser.parse_args(argv)
+
+    if args.command == "quantize":
+        quantize(args.model, args.output, [op.strip() for op in args.ops.split(",") if op.strip()])
+        print(f"Wrote {args.output}")
+        return 0
+    engines = [make_engine(name, **({"model_path": args.model} if name == "onnx" else {})) for name in (args.reference, args.candidate)]
+    rows = compare(*engines, texts=args.text or PARITY_TEXTS, voice=args.voice)
+    print(f"{'audio s':>8}{'rtf ' + args.reference:>12}{'rtf ' + args.candidate:>12}{'length':>9}{'similarity':>12}  ok")
+    for row in rows:
+        print(f"{row['audio_seconds'][0]:>8.2f}{row['rtf'][0]:>12.3f}{row['rtf'][1]:>12.3f}{row['length_diff']:>8.1%}{row['similarity']:>12.3f}  {'yes' if row['ok'] else 'NO'}")
+    return 0 if all(row["ok"] for row in rows) else 1
+
+if __name__ == "__main__":
+    sys.exit(run())
@@ -0,0 +1,72 @@
+from contextlib import asynccontextmanager, aclosing
+from starlette.formparsers import MultiPartParser, MultiPartException
+from fastapi import HTTPException
+from dotenv import load_dotenv
+import os
+import tempfile
+load_dotenv()
+
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("UPLOAD_SPOOL_BYTES", str(1024 * 1024)))
+
+class UploadTooLargeError(Exception):
+    def __init__(self, limit):
+        super().__init__(f"Upload exceeds {limit} bytes")
+        self.limit = limit
+
+async def _limited(stream):
+    # Counts the body as it arrives, so a chunked upload without Content-Length cannot grow past the limit
+    size = 0
+    async for chunk in stream:
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise UploadTooLargeError(MAX_UPLOAD_BYTES)
+        yield chunk
+
+@asynccontextmanager
+async def read_upload(request, field):
+    """Yields (file, fields) for a multipart/form-data or application/octet-stream request.
+
+    For multipart the media is the `field` part and the other fields come from the form.
+    For a raw body the media is the body itself and the fields come from the query string.
+    The file is a spooled temporary file (in memory up to UPLOAD_SPOOL_BYTES) and is
+    closed when the block exits.
+    """
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES:
+        raise UploadTooLargeError(MAX_UPLOAD_BYTES)
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        # Parsed here rather than with request.form(), which would spool the whole body before any check
+        try:
+            async with aclosing(_limited(request.stream())) as stream:
+                form = await MultiPartParser(request.headers, stream).parse()
+        except MultiPartException as e:
+            raise HTTPException(status_code=400, detail=e.message)
+        try:
+            upload = form.get(field)
+            fields = {k: v for k, v in form.items() if isinstance(v, str)}
+            if upload is None or isinstance(upload, str):
+                yield None, fields
+                return
+            upload.file.seek(0)
+            yield upload.file, fields
+        finally:
+            await form.close()
+        return
+
+    spool = tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_BYTES)
+    try:
+        size = 0
+        async with aclosing(_limited(request.stream())) as stream:
+            async for chunk in stream:
+                size += len(chunk)
+                spool.write(chunk)
+        spool.seek(0)
+        yield (spool if size else None), dict(request.query_params)
+    finally:
+        spool.close()
+
+def form_flag(value) -> bool:
+    return str(value or "").strip().lower() in ("1", "true", "yes", "on")